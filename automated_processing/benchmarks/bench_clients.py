@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк клиентских скриптов на синтетических файлах (см. synthetic.py).
+
+Каждый случай (клиент x формат x число строк) выполняется в отдельном процессе — так же, как задача
+в режиме EXEC_MODE="subprocess": main(payload) клиентского скрипта (или common/spec_runner.py для клиента,
+описанного спецификацией) с выводом во временный каталог.
+Время по стадиям (import, read, schema, transform, write; при потоковом чтении — суммарно по частям)
+берется из span'ов трассировки (common/trace.py), пиковая память — peak RSS процесса.
+
+Результат — JSON в benchmarks/results/bench_{YYYYMMDD_HHMMSS}.json; --baseline печатает сравнение
+с прошлым прогоном.
+
+Примеры:
+    python benchmarks/bench_clients.py --sizes 10000,100000
+    python benchmarks/bench_clients.py --clients Client_02 --formats xlsx --baseline benchmarks/results/bench_....json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT_DIR = BENCH_DIR.parent                      # automated_processing
+SCRIPTS_DIR = ROOT_DIR / "Scripts" / "Distibutors"
+HEADER_PATH = ROOT_DIR / "report_header" / "report_header.xlsx"
+RESULTS_DIR = BENCH_DIR / "results"
+
+DEFAULT_CLIENTS = ["Client_01", "Client_02", "Client_03"]
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+CASE_TIMEOUT_SEC = 3600
+
+sys.path.insert(0, str(ROOT_DIR))
+
+
+def _peak_rss_mb() -> float | None:
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 1024  # macOS — байты, Linux — КБ
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2**20  # Windows
+    except (ImportError, AttributeError):
+        return None
+
+
+# ---------- один случай (дочерний процесс) ----------
+
+def run_case(client: str, src: str, out_dir: str) -> dict:
+    """Выполняется в дочернем процессе: pandas и клиентский скрипт импортируются с нуля."""
+    import importlib.util
+    from common.trace import read_spans
+
+    trace = os.path.join(out_dir, "trace.jsonl")
+    os.environ.update(TASK_TRACE=trace, TASK_ID="1", TASK_CLIENT=client)
+    os.environ.pop("TASK_MANIFEST", None)
+
+    t0 = time.perf_counter()
+    payload = {"id": 1, "file_path": src, "status": "NEW", "data_provider": "Дистрибьютор",
+               "client_name": client, "report_type": "Type1"}
+    script = SCRIPTS_DIR / client / f"{client}_processing.py"
+    if not script.is_file():  # клиент описан спецификацией — как в оркестраторе, через spec_runner
+        script = ROOT_DIR / "common" / "spec_runner.py"
+        os.environ["TASK_SPEC"] = str(SCRIPTS_DIR / client / f"{client}_spec.json")
+    spec = importlib.util.spec_from_file_location(f"bench_{client}", script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    from common import engine
+    for target in (engine, module):
+        if hasattr(target, "OUTPUT_DIR"):
+            target.OUTPUT_DIR = Path(out_dir)
+        if hasattr(target, "HEADER_PATH"):
+            target.HEADER_PATH = HEADER_PATH
+        if hasattr(target, "PROFILE_DIR"):
+            target.PROFILE_DIR = Path(out_dir) / "profiles"  # каждый случай — без профиля (первый файл клиента)
+    module.main(payload)
+    wall = time.perf_counter() - t0
+
+    phases: dict[str, float] = {}
+    out_rows = None
+    for span in read_spans(trace):
+        phases[span["phase"]] = round(phases.get(span["phase"], 0.0) + span["dur_ms"] / 1000, 4)
+        if span["phase"] == "write":
+            out_rows = span.get("rows")
+    outputs = [p for p in Path(out_dir).iterdir() if p.is_file() and p.name != "trace.jsonl"]
+    return dict(wall_sec=round(wall, 4), phases=phases, output_rows=out_rows,
+                output_bytes=sum(p.stat().st_size for p in outputs), peak_rss_mb=_peak_rss_mb())
+
+
+def _child_main(args) -> None:
+    result = run_case(args.client, args.src, args.out_dir)
+    print("BENCH_RESULT " + json.dumps(result))
+
+
+# ---------- прогон (родительский процесс) ----------
+
+def spawn_case(client: str, src: Path) -> dict:
+    out_dir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        proc = subprocess.run(
+            [sys.executable, __file__, "--case", "--client", client, "--src", str(src), "--out-dir", out_dir],
+            capture_output=True, text=True, encoding="utf-8", errors="replace", timeout=CASE_TIMEOUT_SEC,
+            env=dict(os.environ, PYTHONIOENCODING="utf-8"),
+        )
+    except subprocess.TimeoutExpired:
+        return dict(ok=False, error="TIMEOUT")
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith("BENCH_RESULT "):
+            return dict(ok=True, **json.loads(line[len("BENCH_RESULT "):]))
+    return dict(ok=False, error=f"RETURN_CODE_{proc.returncode}", stderr=proc.stderr[-1000:])
+
+
+def environment() -> dict:
+    import pandas as pd
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return dict(python=platform.python_version(), pandas=pd.__version__, platform=platform.platform(),
+                cpu_count=os.cpu_count(), commit=commit)
+
+
+def compare(cases: list[dict], baseline_path: str) -> None:
+    with open(baseline_path, encoding="utf-8") as f:
+        base = {(c["client"], c["format"], c["rows"]): c for c in json.load(f)["cases"]}
+    print(f"\nСравнение с {baseline_path} (x — во сколько раз изменилось, <1 — быстрее/меньше):")
+    for c in cases:
+        b = base.get((c["client"], c["format"], c["rows"]))
+        if not b or not (b.get("ok") and c.get("ok")):
+            continue
+        mem = (f"{c['peak_rss_mb'] / b['peak_rss_mb']:.2f}"
+               if c.get("peak_rss_mb") and b.get("peak_rss_mb") else "-")
+        print(f"  {c['client']:<10} {c['format']:<22} {c['rows']:>9}  "
+              f"wall x{c['wall_sec'] / b['wall_sec']:.2f}  peak_rss x{mem}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк клиентских скриптов на синтетических файлах")
+    parser.add_argument("--clients", default=",".join(DEFAULT_CLIENTS))
+    parser.add_argument("--formats", default=None, help="через запятую; по умолчанию все из synthetic.FORMATS")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)))
+    parser.add_argument("--repeat", type=int, default=1, help="прогонов на случай (берется лучший по wall)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="файл результата (по умолчанию results/bench_<время>.json)")
+    parser.add_argument("--baseline", default=None, help="прошлый результат для сравнения")
+    # режим дочернего процесса
+    parser.add_argument("--case", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--client", help=argparse.SUPPRESS)
+    parser.add_argument("--src", help=argparse.SUPPRESS)
+    parser.add_argument("--out-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        _child_main(args)
+        return
+
+    from synthetic import FORMATS, ensure_file
+
+    clients = [c for c in args.clients.split(",") if c]
+    formats = args.formats.split(",") if args.formats else list(FORMATS)
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+
+    cases = []
+    for rows in sizes:
+        for client in clients:
+            for fmt in formats:
+                t0 = time.perf_counter()
+                src = ensure_file(client, fmt, rows, args.seed)
+                if src is None:
+                    print(f"[WARN] {client} {fmt} {rows}: формат недоступен (xls: нужен xlwt, <= 65535 строк)")
+                    continue
+                print(f"[STEP] {client} {fmt} {rows} строк (файл {src.stat().st_size / 2**20:.1f} МБ, "
+                      f"подготовка {time.perf_counter() - t0:.1f}s)...", flush=True)
+                runs = [spawn_case(client, src) for _ in range(max(1, args.repeat))]
+                ok_runs = [r for r in runs if r.get("ok")]
+                best = min(ok_runs, key=lambda r: r["wall_sec"]) if ok_runs else runs[-1]
+                case = dict(client=client, format=fmt, rows=rows, input_bytes=src.stat().st_size, **best)
+                cases.append(case)
+                if case["ok"]:
+                    stages = ", ".join(f"{k}={v:.2f}" for k, v in case["phases"].items())
+                    print(f"   wall={case['wall_sec']:.2f}s peak_rss={case['peak_rss_mb'] or 0:.0f}MB | {stages}")
+                else:
+                    print(f"   [WARN] ошибка: {case['error']}")
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    out = Path(args.out) if args.out else RESULTS_DIR / f"bench_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(dict(environment=environment(), seed=args.seed, cases=cases), f, ensure_ascii=False, indent=1)
+    print(f"\n[STEP] Результаты: {out}")
+    if args.baseline:
+        compare(cases, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Синтетические файлы дистрибьюторов для бенчмарков: столбцы — ключи FIELD_MAP клиента, значения —
+правдоподобные (повторяющиеся справочники, даты в форматах клиента, "битые" значения в малой доле).
+
+Форматы (FORMATS):
+- csv-<кодировка>-<разделитель>: utf-8-sig / cp1251 / utf-8, ';' или ',';
+- xlsx: перед шапкой 3 служебные строки (как в выгрузках из учетных систем — проверяет поиск шапки);
+- xls: нужен пакет xlwt, не больше XLS_MAX_ROWS строк.
+
+Файлы кэшируются в DATA_DIR по имени (клиент, формат, строки, seed) — повторный прогон их не пересоздает.
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+XLS_MAX_ROWS = 65535
+
+FORMATS = {
+    "csv-utf8sig-semicolon": dict(kind="csv", encoding="utf-8-sig", sep=";"),
+    "csv-cp1251-semicolon": dict(kind="csv", encoding="cp1251", sep=";"),
+    "csv-utf8-comma": dict(kind="csv", encoding="utf-8", sep=","),
+    "xlsx": dict(kind="xlsx"),
+    "xls": dict(kind="xls"),
+}
+
+REGIONS = ["Москва", "Московская обл.", "Тверская обл.", "Тульская обл.", "Калужская обл.", "Рязанская обл.",
+           "Санкт-Петербург", "Ленинградская обл.", "Новгородская обл.", "Псковская обл."]
+CITIES = ["Москва", "Химки", "Тверь", "Тула", "Калуга", "Рязань", "Санкт-Петербург", "Гатчина", "Великий Новгород",
+          "Псков", "Подольск", "Мытищи", "Королев", "Обнинск", "Новомосковск"]
+STREETS = ["ул. Ленина", "ул. Мира", "пр-т Победы", "ул. Садовая", "ул. Советская", "ш. Энтузиастов"]
+BRANCHES = ["Филиал Центр", "Филиал Север", "Филиал Юг", "Филиал Запад"]
+PRODUCTS = [f"Препарат {i} таб. {d} мг №{k}" for i in range(1, 61) for d in (5, 10) for k in (10, 30)]
+CLIENTS = [f'ООО "Аптека {i}"' for i in range(1, 301)]
+MONTHS_EN = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+MONTHS_RU = ["янв", "фев", "мар", "апр", "май", "июн", "июл", "авг", "сен", "окт", "ноя", "дек"]
+
+
+def _pick(rng, pool, n):
+    return np.asarray(pool, dtype=object)[rng.integers(0, len(pool), n)]
+
+
+def _days(rng, n):
+    return pd.Timestamp("2025-01-01") + pd.to_timedelta(rng.integers(0, 365, n), unit="D")
+
+
+def _dates_ddmmyyyy(rng, n):
+    return _days(rng, n).strftime("%d.%m.%Y").to_numpy(dtype=object)
+
+
+def _dates_client01(rng, n):
+    """Client_01: в основном dd.mm.yyyy, часть — "Feb 03 2025 12:00AM" и "фев 4 2025", редкий мусор."""
+    d = _days(rng, n)
+    out = d.strftime("%d.%m.%Y").to_numpy(dtype=object)
+    kind = rng.random(n)
+    en = kind < 0.15
+    ru = (kind >= 0.15) & (kind < 0.25)
+    bad = kind > 0.995
+    out[en] = [f"{MONTHS_EN[x.month - 1]} {x.day:02d} {x.year} 12:00AM" for x in d[en]]
+    out[ru] = [f"{MONTHS_RU[x.month - 1]} {x.day} {x.year}" for x in d[ru]]
+    out[bad] = "н/д"
+    return out
+
+
+def _dates_client02(rng, n):
+    """Client_02 ("день"): dd.mm.yyyy, серийные номера Excel и ISO."""
+    d = _days(rng, n)
+    out = d.strftime("%d.%m.%Y").to_numpy(dtype=object)
+    kind = rng.random(n)
+    serial = kind < 0.2
+    iso = (kind >= 0.2) & (kind < 0.3)
+    out[serial] = ((d[serial] - pd.Timestamp("1899-12-30")).days).astype(str)
+    out[iso] = d[iso].strftime("%Y-%m-%d")
+    return out
+
+
+def _inn(rng, n):
+    return rng.integers(7_700_000_000, 7_799_999_999, n)
+
+
+def _qty(rng, n):
+    return rng.choice([0, 1, 1, 1, 2, 2, 3, 5, 10], n)
+
+
+def _address(rng, n):
+    return _pick(rng, STREETS, n) + ", д. " + rng.integers(1, 120, n).astype(str)
+
+
+# генераторы по столбцам исходных файлов клиента (ключи FIELD_MAP без полей реестра)
+CLIENT_COLUMNS = {
+    "Client_01": {
+        "инн": _inn,
+        "клиент": lambda rng, n: _pick(rng, CLIENTS, n),
+        "область_район": lambda rng, n: _pick(rng, REGIONS, n),
+        "город": lambda rng, n: _pick(rng, CITIES, n),
+        "адрес": _address,
+        "название": lambda rng, n: _pick(rng, PRODUCTS, n),
+        "количество": _qty,
+        "филиал": lambda rng, n: _pick(rng, BRANCHES, n),
+        "код_клиента": lambda rng, n: rng.integers(1, 5000, n),
+        "номер_документа": lambda rng, n: rng.integers(100000, 999999, n),
+        "дата_документа": _dates_client01,
+        "код_товара": lambda rng, n: rng.integers(1, 240, n),
+    },
+    "Client_02": {
+        "филиал": lambda rng, n: _pick(rng, BRANCHES, n),
+        "клиент": lambda rng, n: _pick(rng, CLIENTS, n),
+        "регион": lambda rng, n: _pick(rng, REGIONS, n),
+        "город": lambda rng, n: _pick(rng, CITIES, n),
+        "улица": _address,
+        "товар": lambda rng, n: _pick(rng, PRODUCTS, n),
+        "инн клиента": _inn,
+        "uid товара": lambda rng, n: rng.integers(1, 240, n),
+        "день": _dates_client02,
+        "аптека.ру": lambda rng, n: _pick(rng, ["да", "нет", "", "Да"], n),
+        "продажи, шт.": _qty,
+    },
+    "Client_03": {
+        "региональная компания": lambda rng, n: _pick(rng, BRANCHES, n),
+        "дата": _dates_ddmmyyyy,
+        "код": lambda rng, n: rng.integers(1, 240, n),
+        "товар": lambda rng, n: _pick(rng, PRODUCTS, n),
+        "код контрагента": lambda rng, n: rng.integers(1, 5000, n),
+        "клиент": lambda rng, n: _pick(rng, CLIENTS, n),
+        "инн": _inn,
+        "код адреса доставки": lambda rng, n: rng.integers(1, 20000, n),
+        "адрес доставки": _address,
+        "регион доставки": lambda rng, n: _pick(rng, REGIONS, n),
+        "город доставки": lambda rng, n: _pick(rng, CITIES, n),
+        "признак тендер": lambda rng, n: _pick(rng, ["да", "нет", "Нет"], n),
+        "количество": _qty,
+    },
+}
+
+
+def make_frame(client: str, rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({col: gen(rng, rows) for col, gen in CLIENT_COLUMNS[client].items()})
+
+
+def _write_xlsx(df: pd.DataFrame, path: Path) -> None:
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)  # потоковая запись: 1M строк без объектной модели листа в памяти
+    ws = wb.create_sheet()
+    ws.append(["Отчет о продажах"])
+    ws.append(["Период: 2025"])
+    ws.append([])
+    ws.append(list(df.columns))
+    for rec in df.itertuples(index=False, name=None):
+        ws.append([x.item() if isinstance(x, np.generic) else x for x in rec])
+    wb.save(path)
+
+
+def _write_xls(df: pd.DataFrame, path: Path) -> None:
+    import xlwt  # pandas больше не пишет .xls
+    wb = xlwt.Workbook(encoding="utf-8")
+    ws = wb.add_sheet("Sheet1")
+    for j, col in enumerate(df.columns):
+        ws.write(0, j, col)
+    for i, rec in enumerate(df.itertuples(index=False, name=None), start=1):
+        for j, x in enumerate(rec):
+            ws.write(i, j, x.item() if isinstance(x, np.generic) else x)
+    wb.save(str(path))
+
+
+def ensure_file(client: str, fmt: str, rows: int, seed: int = 0, data_dir: Path = DATA_DIR) -> Path | None:
+    """Путь к синтетическому файлу (создается при первом обращении); None — формат недоступен."""
+    spec = FORMATS[fmt]
+    if spec["kind"] == "xls" and rows > XLS_MAX_ROWS:
+        return None
+    ext = {"csv": ".csv", "xlsx": ".xlsx", "xls": ".xls"}[spec["kind"]]
+    path = data_dir / f"{client}_{fmt}_{rows}_s{seed}{ext}"
+    if path.exists():
+        return path
+    data_dir.mkdir(parents=True, exist_ok=True)
+    df = make_frame(client, rows, seed)
+    tmp = path.with_name(path.name + ".tmp")
+    try:
+        if spec["kind"] == "csv":
+            df.to_csv(tmp, sep=spec["sep"], index=False, encoding=spec["encoding"])
+        elif spec["kind"] == "xlsx":
+            _write_xlsx(df, tmp)
+        else:
+            try:
+                _write_xls(df, tmp)
+            except ImportError:
+                return None
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return path
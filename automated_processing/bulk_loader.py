@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Загрузка итоговых CSV в промежуточную таблицу Postgres (COPY FROM STDIN) — вместо переноса в LOAD_DIR.
+
+Файлы задачи грузятся одной транзакцией вместе с финальным статусом строки реестра (finish(cur)):
+CREATED значит, что данные уже в таблице; при ошибке не остается ни строк, ни статуса.
+- таблица: столбцы целевой схемы как text (промежуточный слой, типы приводит дальнейшая загрузка)
+  + file_id и loaded_at; создается при старте, новые столбцы шапки добавляются;
+- файл идет в COPY как есть, без разбора и перезаписи: file_id — значение по умолчанию из настройки
+  транзакции (set_config), столбцы COPY — шапка файла (CSV движка: ';', UTF-8 с BOM);
+- строки прошлой загрузки того же id удаляются в той же транзакции — повтор задачи не дублирует данные;
+- у каждого потока пула свое соединение: длинный COPY не держит общее соединение оркестратора.
+"""
+
+import csv
+import threading
+from pathlib import Path
+
+import psycopg2
+from psycopg2 import sql
+
+COPY_CHUNK_BYTES = 1 << 20
+FILE_ID_SETTING = "ops.load_file_id"  # настройка транзакции, из которой берется file_id загружаемых строк
+CSV_DELIMITER = ";"
+
+
+class LoadError(Exception):
+    """Файл нельзя загрузить в таблицу (шапка не совпадает со столбцами)."""
+
+
+class BulkLoader:
+    def __init__(self, connect, table: str, columns: list[str], log=print):
+        self.connect = connect
+        self.table_name = table
+        self.table = sql.Identifier(*table.split("."))
+        self.columns = list(columns)
+        self.log = log
+        self._local = threading.local()
+        self._conns: list = []
+        self._lock = threading.Lock()
+
+    # --- соединения ---
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or conn.closed:
+            conn = self.connect()
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def _drop_conn(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+
+    def close(self) -> None:
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+
+    # --- схема ---
+
+    def ensure_table(self) -> None:
+        """Таблица и столбцы целевой схемы (идемпотентно)."""
+        schema, _, name = self.table_name.rpartition(".")
+        ddl = []
+        if schema:
+            ddl.append(sql.SQL("CREATE SCHEMA IF NOT EXISTS {};").format(sql.Identifier(schema)))
+        ddl.append(sql.SQL("""
+            CREATE TABLE IF NOT EXISTS {} (
+                file_id   bigint      NOT NULL DEFAULT NULLIF(current_setting({}, true), '')::bigint,
+                loaded_at timestamptz NOT NULL DEFAULT now()
+            );
+        """).format(self.table, sql.Literal(FILE_ID_SETTING)))
+        ddl += [sql.SQL("ALTER TABLE {} ADD COLUMN IF NOT EXISTS {} text;").format(self.table, sql.Identifier(c))
+                for c in self.columns]
+        ddl.append(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} (file_id);")
+                   .format(sql.Identifier(f"{name}_file_id_idx"), self.table))
+        conn = self._conn()
+        try:
+            with conn.cursor() as cur:
+                for stmt in ddl:
+                    cur.execute(stmt)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def file_columns(self, path: Path) -> list[str]:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            header = next(csv.reader(f, delimiter=CSV_DELIMITER), [])
+        unknown = [c for c in header if c not in self.columns]
+        if not header or unknown:
+            raise LoadError(f"{Path(path).name}: столбцы не из шапки отчета: {unknown or 'нет шапки'}")
+        return header
+
+    # --- загрузка ---
+
+    def load(self, task_id: int, files: list[Path], finish) -> int:
+        """
+        Все файлы задачи -> таблица, затем finish(cur) (финальный статус) и один commit.
+        Возвращает число загруженных строк; при ошибке транзакция откатывается целиком.
+        """
+        conn = self._conn()
+        rows = 0
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT set_config(%s, %s, true);", (FILE_ID_SETTING, str(task_id)))
+                cur.execute(sql.SQL("DELETE FROM {} WHERE file_id = %s;").format(self.table), (task_id,))
+                for path in files:
+                    copy = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv, HEADER true, DELIMITER {}, "
+                                   "ENCODING 'UTF8');").format(
+                        self.table, sql.SQL(", ").join(map(sql.Identifier, self.file_columns(path))),
+                        sql.Literal(CSV_DELIMITER))
+                    with open(path, "rb") as f:
+                        cur.copy_expert(copy.as_string(conn), f, size=COPY_CHUNK_BYTES)
+                    rows += max(cur.rowcount, 0)
+                finish(cur)
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self._drop_conn()  # соединение потеряно — следующая загрузка переподключится
+            raise
+        except Exception:
+            conn.rollback()
+            raise
+        return rows
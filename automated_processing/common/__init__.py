@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""
+Общий код оркестратора и клиентских скриптов.
+
+Клиенты описаны спецификациями Scripts\<провайдер>\<клиент>\<клиент>_spec.json; их выполняет общий скрипт
+common\spec_runner.py (оркестратор передает путь спецификации в TASK_SPEC) на движке common\engine.py.
+spec_runner.py перед импортом добавляет в sys.path каталог automated_processing (parents[1] от своего файла).
+"""
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Нормализация дат целыми столбцами.
+
+normalize_date — эталон для одного значения (правило "date" спецификации, см. engine.py).
+normalize_dates дает тот же результат для столбца, но:
+- каждое различное сырое значение разбирается один раз (pd.factorize: миллион строк — обычно сотни дат);
+- форматы определяются по выборке различных значений, и подходящие применяются ко всем значениям
+  сразу (pd.to_datetime(format=...)) в порядке спецификации;
+- серийные номера Excel и столбцы datetime64 переводятся векторно;
+- что не разобралось векторно (месяцы по-русски, "мусор", экзотика) — через normalize_date,
+  опять же по одному разу на значение.
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+MONTHS_RU = {'янв': 1, 'фев': 2, 'мар': 3, 'апр': 4, 'май': 5, 'июн': 6,
+             'июл': 7, 'авг': 8, 'сен': 9, 'окт': 10, 'ноя': 11, 'дек': 12}
+EXCEL_EPOCH = datetime(1899, 12, 30)
+SAMPLE_SIZE = 200               # различных значений для определения форматов
+SAFE_YEARS = (1900, 2200)       # вне диапазона результат векторного пути перепроверяем поштучно
+EXCEL_SERIAL_MAX = 2958465      # 31.12.9999
+
+
+def normalize_date(val, formats=("%d.%m.%Y",), ru_months=False, excel_serial=False,
+                   dayfirst_fallback=False, out_format="%d.%m.%Y") -> str | None:
+    if val is None or (not isinstance(val, str) and pd.isna(val)):
+        return None
+    if isinstance(val, datetime):
+        return val.strftime(out_format)
+    if excel_serial and isinstance(val, (int, float, np.integer, np.floating)) and not isinstance(val, bool):
+        try:
+            return (EXCEL_EPOCH + timedelta(days=int(float(val)))).strftime(out_format)
+        except (ValueError, OverflowError):
+            pass
+    s = str(val).strip().replace("  ", " ")
+    for fmt in formats:
+        try:
+            return datetime.strptime(s, fmt).strftime(out_format)
+        except ValueError:
+            pass
+    if ru_months:
+        parts = s.split()
+        if len(parts) >= 3:
+            mon = MONTHS_RU.get(parts[0].lower()[:3])
+            try:
+                day = int(parts[1]); year = int(parts[2])
+                if mon:
+                    return datetime(year, mon, day).strftime(out_format)
+            except ValueError:
+                return None
+    if dayfirst_fallback:
+        try:
+            dt = pd.to_datetime(s, dayfirst=True, errors="coerce")
+            if pd.notna(dt):
+                return dt.strftime(out_format)
+        except (ValueError, OverflowError):
+            pass
+    return None
+
+
+def _format_safe(parsed: pd.Series, out_format: str) -> pd.Series:
+    """strftime для разобранных значений в безопасном диапазоне лет; остальное -> NaN (перепроверка поштучно)."""
+    ok = parsed.notna() & parsed.dt.year.between(*SAFE_YEARS)
+    res = pd.Series(np.nan, index=parsed.index, dtype=object)
+    if ok.any():
+        res[ok] = parsed[ok].dt.strftime(out_format)
+    return res
+
+
+def detect_formats(strings: pd.Series, formats) -> list[str]:
+    """Форматы (в порядке спецификации), под которые подходит хотя бы одно значение выборки."""
+    sample = strings.head(SAMPLE_SIZE)
+    return [fmt for fmt in formats
+            if pd.to_datetime(sample, format=fmt, errors="coerce").notna().any()]
+
+
+def normalize_dates(series: pd.Series, formats=("%d.%m.%Y",), ru_months=False, excel_serial=False,
+                    dayfirst_fallback=False, out_format="%d.%m.%Y") -> pd.Series:
+    """Столбец -> строки out_format (None — не распознано); то же, что series.map(normalize_date)."""
+    opts = dict(formats=tuple(formats), ru_months=ru_months, excel_serial=excel_serial,
+                dayfirst_fallback=dayfirst_fallback, out_format=out_format)
+    if pd.api.types.is_datetime64_any_dtype(series):
+        res = series.dt.strftime(out_format).astype(object)
+        return res.where(series.notna(), None)
+
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    uniques = pd.Series(uniques, dtype=object)
+    done = pd.Series(np.nan, index=uniques.index, dtype=object)
+
+    # объекты даты (ячейки Excel) и серийные номера Excel
+    is_dt = uniques.map(lambda v: isinstance(v, datetime))
+    if is_dt.any():
+        done[is_dt] = _format_safe(pd.to_datetime(uniques[is_dt], errors="coerce"), out_format)
+    is_num = uniques.map(lambda v: isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, bool))
+    if excel_serial and is_num.any():
+        nums = uniques[is_num].astype(float)
+        in_range = nums.abs() <= EXCEL_SERIAL_MAX
+        days = np.trunc(nums[in_range])
+        parsed = pd.Series(pd.Timestamp(EXCEL_EPOCH) + pd.to_timedelta(days, unit="D"), index=days.index)
+        done[parsed.index] = _format_safe(parsed, out_format)
+
+    # строки: форматы, которые встречаются в выборке, — векторно, по порядку спецификации
+    todo = done.isna() & ~is_dt & ~(is_num & excel_serial)
+    strings = uniques[todo].astype(str).str.strip().str.replace("  ", " ", regex=False)
+    for fmt in detect_formats(strings, opts["formats"]) if len(strings) else ():
+        pending = done[strings.index].isna()
+        if not pending.any():
+            break
+        sub = strings[pending.values]
+        done[sub.index] = done[sub.index].where(
+            done[sub.index].notna(), _format_safe(pd.to_datetime(sub, format=fmt, errors="coerce"), out_format))
+
+    # остаток (русские месяцы, запасной разбор, нераспознанное) — поштучно, по разу на значение
+    rest = done.isna()
+    if rest.any():
+        done[rest] = uniques[rest].map(lambda v: normalize_date(v, **opts))
+
+    values = done.to_numpy(dtype=object)
+    res = np.where(codes >= 0, values[np.maximum(codes, 0)] if len(values) else None, None)
+
+    # factorize не различает True/1 и False/0 — такие строки пересчитываем поштучно
+    ambiguous = uniques.map(lambda v: isinstance(v, (bool, np.bool_, int, float, np.number)) and v in (0, 1))
+    if ambiguous.any():
+        rows = np.isin(codes, np.flatnonzero(ambiguous.to_numpy()))
+        res[rows] = [normalize_date(v, **opts) for v in series.to_numpy(dtype=object)[rows]]
+    return pd.Series(res, index=series.index, dtype=object)
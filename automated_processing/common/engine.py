@@ -0,0 +1,726 @@
+# -*- coding: utf-8 -*-
+"""
+Общий движок клиентских скриптов: клиент описывается спецификацией, а не кодом.
+
+Спецификация ({Client}_spec.json в папке клиента):
+    {
+      "client_name": "Client_01",
+      "report_type": "Type1",
+      "columns":  {"инн": "client_inn", ...},              # исходный столбец -> столбец report_header
+      "registry": {"file_path": "filename_ish", ...},       # поле строки реестра -> столбец (одно значение на файл)
+      "derived":  [                                         # вычисляемые столбцы, по порядку
+        {"target": "period", "rule": "date", "source": "дата_документа", "formats": ["%d.%m.%Y"]},
+        {"target": "market", "rule": "map", "source": "признак тендер",
+         "values": {"да": "Тендер"}, "default": "Коммерция"},
+        {"target": "naklad", "rule": "concat", "parts": ["@номер_документа", " от ", "$period"]}
+      ],
+      "filters":  [{"column": "amount_type_1", "op": "!=", "value": 0}]
+    }
+
+Правила (RULES):
+- date   — нормализация даты в out_format (по умолчанию dd.mm.yyyy): форматы strptime по порядку,
+           ru_months ("фев 4 2025"), excel_serial (числа — серийные даты Excel), dayfirst_fallback
+           (pd.to_datetime(dayfirst=True)); объекты даты из Excel форматируются сразу; не распознано — пусто.
+           Столбец разбирается целиком (common/dates.py): каждое различное значение — один раз, форматы
+           из выборки — векторно; результат тот же, что у normalize_date по каждому значению;
+- map    — значение после strip().lower(): сначала точное совпадение values, затем подстрока contains
+           (по порядку), иначе default (без default — нормализованное значение);
+- concat — склейка частей: "@столбец" — исходный столбец (как строка), "$столбец" — уже вычисленный
+           столбец результата (пусто вместо None), остальное — литерал; если какого-то столбца нет — пропуск.
+
+Спецификация компилируется один раз (TransformPlan, кэш по пути и mtime файла): итоговый кадр собирается
+за один вызов pd.DataFrame из готовых столбцов, без цикла присваиваний. Чтение (csv / xlsx / xls, поиск шапки),
+запись, манифест и трассировка — общие для всех клиентов.
+
+CSV: разделитель определяется по строке шапки (sniff_delimiter), файл больше CSV_STREAM_MIN_BYTES обрабатывается
+частями по CSV_CHUNK_ROWS строк (чтение -> план -> дозапись), так что память не зависит от размера файла.
+XLSX читается всегда потоком (openpyxl read_only): шапка ищется по мере чтения первых строк, данные идут
+в план частями по XLSX_BATCH_ROWS — ни объектной модели книги, ни таблицы целиком в памяти.
+Результат (CSV по умолчанию, Parquet или Arrow — common/writers.py) пишется в {имя}.part и переименовывается,
+когда готов целиком.
+Пакетный запуск (TASK_IDS, run_batch): строки реестра из TASK_PAYLOADS обрабатываются по очереди в одном процессе,
+итог по каждому id — в манифест.
+Целевые столбцы и их порядок — из скомпилированной схемы report_header.xlsx (common/schema.py).
+"""
+
+import os
+import csv
+import json
+import time
+import operator
+import traceback
+from datetime import datetime
+from itertools import chain, islice
+from pathlib import Path
+
+import chardet
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+from common.dates import normalize_dates
+from common.schema import TargetSchema, load_schema
+from common.trace import task_tracer
+from common.writers import OUTPUT_FORMATS, CsvWriter, open_writer, resolve_format
+
+# === Пути ===
+REESTR_PATH = Path(r"C:\Users\user\Desktop\Python_scripts\automated_processing\Reestr\new_files_registry.csv")
+HEADER_PATH = Path(r"C:\Users\user\Desktop\Python_scripts\automated_processing\report_header\report_header.xlsx")
+OUTPUT_DIR  = Path(r"C:\Users\user\Desktop\Итоговые отчеты")
+PROFILE_DIR = Path(r"C:\Users\user\Desktop\Python_scripts\automated_processing\Profiles")  # профили входных файлов
+
+HEADER_SCAN_ROWS = 10    # шапку Excel ищем в первых N строках
+CSV_DELIMITERS = (";", ",", "\t", "|")  # ';' — приоритетный (как раньше), остальные — по частоте в шапке
+CSV_STREAM_MIN_BYTES = 64 * 2**20        # CSV больше этого читается и пишется частями
+CSV_CHUNK_ROWS = 200_000                 # строк в части: память задачи ограничена частью, а не файлом
+XLSX_BATCH_ROWS = 20_000                 # строк XLSX в части: строки листа — кортежи Python, часть меньше, чем у CSV
+OUTPUT_FORMAT = "csv"                    # "csv" | "parquet" | "arrow"; оркестратор задает TASK_OUTPUT_FORMAT
+PROFILE_CHECK_CHARS = 50_000            # сколько символов начала CSV декодируем при проверке кодировки профиля
+COMPACT_MAX_RATIO = 0.5  # строковый столбец хранится категорией, если различных значений не больше этой доли строк
+
+
+# ========== СПЕЦИФИКАЦИЯ ==========
+
+class ClientSpec:
+    def __init__(self, client_name: str, report_type: str, columns: dict[str, str],
+                 registry: dict[str, str] | None = None, derived: list[dict] | None = None,
+                 filters: list[dict] | None = None):
+        self.client_name = client_name
+        self.report_type = report_type
+        self.columns = {k.lower(): v for k, v in columns.items()}
+        self.registry = dict(registry or {})
+        self.derived = list(derived or [])
+        self.filters = list(filters or [])
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "ClientSpec":
+        return cls(d["client_name"], d["report_type"], d["columns"], d.get("registry"),
+                   d.get("derived"), d.get("filters"))
+
+
+_plans: dict[str, tuple[int, "TransformPlan"]] = {}
+
+def load_plan(spec_path: str | Path) -> "TransformPlan":
+    """Скомпилированный план по файлу спецификации; перекомпилируется, только если файл изменился."""
+    key = os.path.abspath(spec_path)
+    mtime = os.stat(key).st_mtime_ns
+    cached = _plans.get(key)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(key, encoding="utf-8") as f:
+        plan = TransformPlan(ClientSpec.from_dict(json.load(f)))
+    _plans[key] = (mtime, plan)
+    return plan
+
+
+# ========== КОМПАКТНЫЕ СТОЛБЦЫ ==========
+
+def constant_column(value, index: pd.Index) -> pd.Series:
+    """Одно значение на все строки (поля реестра): категория из одного значения, 1 байт на строку."""
+    n = len(index)
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return pd.Series(pd.Categorical.from_codes(np.full(n, -1, dtype=np.int8), categories=[]), index=index)
+    return pd.Series(pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), categories=[value]), index=index)
+
+def compact_column(s: pd.Series, max_ratio: float = COMPACT_MAX_RATIO) -> pd.Series:
+    """Строковый столбец с повторами -> категория (строки не дублируются по строкам); остальное как есть."""
+    if not (s.dtype == object or isinstance(s.dtype, pd.StringDtype)) or len(s) == 0:
+        return s
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    if len(uniques) > max_ratio * len(s) or pd.api.types.infer_dtype(uniques, skipna=True) != "string":
+        return s  # только строки: factorize не различает True/1, а числа в категориях писать незачем
+    return pd.Series(pd.Categorical.from_codes(codes, categories=uniques), index=s.index)
+
+def map_unique(s: pd.Series, func) -> pd.Series:
+    """func по разу на различное значение, результат — категория. NA и значения, равные 0/1 (True == 1
+    для factorize), считаются по самим значениям строк: func может различать None/nan и True/1 (через str)."""
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    values = [func(u) for u in uniques]
+    ambiguous = [i for i, u in enumerate(uniques) if isinstance(u, (bool, np.bool_, int, float, np.number)) and u in (0, 1)]
+    special = codes < 0
+    if ambiguous:
+        special |= np.isin(codes, ambiguous)
+    if special.any():
+        memo: dict = {}
+        rows = np.flatnonzero(special)
+        for v in s.to_numpy(dtype=object)[rows]:
+            key = (type(v), str(v))
+            if key not in memo:
+                memo[key] = len(values)
+                values.append(func(v))
+        codes = codes.copy()
+        codes[rows] = [memo[(type(v), str(v))] for v in s.to_numpy(dtype=object)[rows]]
+    cat_codes, cats = pd.factorize(pd.Index(values, dtype=object), use_na_sentinel=True)
+    return pd.Series(pd.Categorical.from_codes(cat_codes[codes], categories=cats), index=s.index)
+
+
+# ========== ПРАВИЛА ЗНАЧЕНИЙ ==========
+
+def _rule_date(rule: dict):
+    src = rule["source"].lower()
+    opts = dict(
+        formats=tuple(rule.get("formats", ("%d.%m.%Y",))),
+        ru_months=rule.get("ru_months", False),
+        excel_serial=rule.get("excel_serial", False),
+        dayfirst_fallback=rule.get("dayfirst_fallback", False),
+        out_format=rule.get("out_format", "%d.%m.%Y"),
+    )
+
+    def apply(df: pd.DataFrame, out: dict):
+        if src not in df.columns:
+            return None
+        return compact_column(normalize_dates(df[src], **opts))
+    return apply
+
+def _rule_map(rule: dict):
+    src = rule["source"].lower()
+    values = dict(rule.get("values", {}))
+    contains = [tuple(p) for p in rule.get("contains", [])]
+    has_default = "default" in rule
+    default = rule.get("default")
+
+    def convert(v):
+        s = str(v).strip().lower()
+        if s in values:
+            return values[s]
+        for needle, res in contains:
+            if needle in s:
+                return res
+        return default if has_default else s
+
+    def apply(df: pd.DataFrame, out: dict):
+        if src not in df.columns:
+            return None
+        return map_unique(df[src], convert)
+    return apply
+
+def _rule_concat(rule: dict):
+    parts = list(rule["parts"])
+
+    def apply(df: pd.DataFrame, out: dict):
+        pieces = []
+        for p in parts:
+            if p.startswith("@"):
+                col = p[1:].lower()
+                if col not in df.columns:
+                    return None
+                pieces.append(df[col].astype(str))
+            elif p.startswith("$"):
+                col = out.get(p[1:])
+                if not isinstance(col, pd.Series):
+                    return None
+                pieces.append(col.astype(object).fillna("").astype(str))
+            else:
+                pieces.append(p)
+        res = pieces[0]
+        for piece in pieces[1:]:
+            res = res + piece
+        return res
+    return apply
+
+RULES = {"date": _rule_date, "map": _rule_map, "concat": _rule_concat}
+
+FILTER_OPS = {
+    "==": operator.eq, "!=": operator.ne, ">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le,
+}
+
+
+# ========== ПЛАН ПРЕОБРАЗОВАНИЯ ==========
+
+class TransformPlan:
+    """Спецификация, скомпилированная в набор шагов над целыми столбцами."""
+
+    def __init__(self, spec: ClientSpec):
+        self.spec = spec
+        self.header_keys = set(spec.columns) | {k.lower() for k in spec.registry}
+        # несколько исходных столбцов на один целевой — берется последний присутствующий (как в FIELD_MAP)
+        self.sources_by_target: dict[str, list[str]] = {}
+        for src, tgt in spec.columns.items():
+            self.sources_by_target.setdefault(tgt, []).append(src)
+        self.derived = []
+        for rule in spec.derived:
+            if rule["rule"] not in RULES:
+                raise ValueError(f"{spec.client_name}: неизвестное правило '{rule['rule']}'")
+            self.derived.append((rule["target"], RULES[rule["rule"]](rule)))
+        self.filters = []
+        for flt in spec.filters:
+            if flt["op"] not in FILTER_OPS:
+                raise ValueError(f"{spec.client_name}: неизвестный фильтр '{flt['op']}'")
+            self.filters.append((flt["column"], FILTER_OPS[flt["op"]], flt.get("value")))
+
+    def apply(self, df: pd.DataFrame, reg_row: dict, schema: TargetSchema) -> pd.DataFrame | None:
+        """Часть/таблица исходника -> кадр результата сразу в порядке столбцов схемы; None — писать нечего."""
+        cols: dict = {}
+        for tgt, sources in self.sources_by_target.items():
+            present = [s for s in sources if s in df.columns]
+            if present:
+                cols[tgt] = df[present[-1]]
+        if not cols:
+            return None  # ни одного исходного столбца — поля реестра не размножаем на пустой файл
+        for key, tgt in self.spec.registry.items():
+            cols[tgt] = constant_column(reg_row[key], df.index)
+        for tgt, rule in self.derived:
+            res = rule(df, cols)
+            if res is not None:
+                cols[tgt] = res
+
+        keep = None  # фильтры — одна маска на все столбцы (поэлементно, как последовательные отборы)
+        for column, op, value in self.filters:
+            col = cols.get(column)
+            if col is None:
+                continue
+            if isinstance(col.dtype, pd.CategoricalDtype) and op not in (operator.eq, operator.ne):
+                col = col.astype(object)  # порядок у категорий не задан
+            # пропуск (NA в nullable-столбце) — как NaN у float: != дает True, остальные сравнения — False
+            hit = op(col, value).to_numpy(dtype=bool, na_value=op is operator.ne)
+            keep = hit if keep is None else keep & hit
+        index = df.index if keep is None else df.index[keep]
+        if not len(index) or not schema.columns:
+            return None
+
+        # кадр выделяется один раз в итоговом порядке; столбцов схемы, которых нет у клиента, — пустая категория
+        data = {}
+        for name in schema.columns:
+            col = cols.get(name)
+            if col is None:
+                data[name] = constant_column(None, index)
+            else:
+                data[name] = compact_column(col if keep is None else col[keep])
+        return pd.DataFrame(data, index=index, copy=False)
+
+
+# ========== ЧТЕНИЕ ==========
+
+def detect_encoding(file_path: Path) -> str:
+    with open(file_path, "rb") as f:
+        raw = f.read(50000)
+    return chardet.detect(raw).get("encoding") or "utf-8"
+
+def sniff_delimiter(file_path: Path, enc: str) -> str:
+    """Разделитель по строке шапки: ';', если он есть, иначе самый частый из CSV_DELIMITERS."""
+    with open(file_path, encoding=enc, errors="replace", newline="") as f:
+        head = f.readline()
+    if ";" in head:
+        return ";"
+    counts = {d: head.count(d) for d in CSV_DELIMITERS[1:]}
+    best = max(counts, key=counts.get)
+    return best if counts[best] else ";"
+
+def csv_header(file_path: Path, enc: str, sep: str) -> list[str] | None:
+    """Имена столбцов (strip/lower) из строки шапки; None — начало файла не декодируется в enc."""
+    try:
+        with open(file_path, encoding=enc, newline="") as f:
+            head = f.readline()
+            f.read(PROFILE_CHECK_CHARS)
+    except (UnicodeDecodeError, LookupError):
+        return None
+    return [c.strip().lower() for c in next(csv.reader([head.rstrip("\r\n")], delimiter=sep), [])]
+
+def csv_dialect(file_path: Path, profile: dict | None) -> tuple[str, str, str]:
+    """(кодировка, разделитель, откуда): сначала профиль клиента — если шапка файла с ним совпадает,
+    иначе chardet + sniff_delimiter."""
+    if profile and profile.get("encoding") and profile.get("sep"):
+        if csv_header(file_path, profile["encoding"], profile["sep"]) == profile.get("columns"):
+            return profile["encoding"], profile["sep"], "profile"
+    enc = detect_encoding(file_path)
+    return enc, sniff_delimiter(file_path, enc), "detect"
+
+def read_csv(file_path: Path, enc: str | None = None, sep: str | None = None) -> pd.DataFrame:
+    enc = enc or detect_encoding(file_path)
+    sep = sep or sniff_delimiter(file_path, enc)
+    try:
+        df = pd.read_csv(file_path, sep=sep, encoding=enc)
+    except Exception:
+        df = pd.read_csv(file_path, sep="," if sep == ";" else ";", encoding=enc)
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    return df
+
+def _stream_dtype(s: pd.Series):
+    """Тип столбца для всех частей по первой части (целые и пустые столбцы уточняет _scan_dtypes)."""
+    if pd.api.types.is_bool_dtype(s):
+        return "boolean"
+    return s.dtype
+
+def _scan_dtypes(file_path: Path, enc: str, sep: str, columns: list, chunk_rows: int) -> dict:
+    """
+    Типы целых и пустых (в первой части) столбцов — те же, что при чтении файла целиком: отдельный проход
+    только по этим столбцам (usecols). Пропуск или дробь в любой части -> float64 (пишется "1.0", как
+    у таблицы целиком), текст -> str, иначе int64. Без этого результат зависел бы от границ частей.
+    """
+    kinds = {c: set() for c in columns}
+    with pd.read_csv(file_path, sep=sep, encoding=enc, usecols=columns, chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            for c in columns:
+                kinds[c].add(chunk[c].dtype.kind)
+    dtypes = {}
+    for c, k in kinds.items():
+        if k - {"i", "u", "f"}:
+            dtypes[c] = str
+        elif "f" in k:
+            dtypes[c] = "float64"
+        else:
+            dtypes[c] = "int64"
+    return dtypes
+
+def iter_csv_chunks(file_path: Path, chunk_rows: int | None = None, enc: str | None = None, sep: str | None = None):
+    """CSV частями по chunk_rows строк с нормализованными именами столбцов; типы — по первой части, целые
+    и пустые столбцы — по всему файлу (_scan_dtypes), как при чтении целиком (ValueError, если дальше
+    типы первой части не выдерживаются)."""
+    chunk_rows = chunk_rows or CSV_CHUNK_ROWS
+    enc = enc or detect_encoding(file_path)
+    sep = sep or sniff_delimiter(file_path, enc)
+    first = pd.read_csv(file_path, sep=sep, encoding=enc, nrows=chunk_rows)
+    dtypes = {c: _stream_dtype(first[c]) for c in first.columns}
+    scan = [c for c in first.columns if pd.api.types.is_integer_dtype(first[c]) or first[c].isna().all()]
+    del first
+    if scan:
+        dtypes.update(_scan_dtypes(file_path, enc, sep, scan, chunk_rows))
+    with pd.read_csv(file_path, sep=sep, encoding=enc, chunksize=chunk_rows, dtype=dtypes) as reader:
+        for chunk in reader:
+            chunk.columns = [str(c).strip().lower() for c in chunk.columns]
+            yield chunk
+
+def header_index(rows: list[tuple], keys: set[str]) -> int | None:
+    """Номер строки шапки среди первых строк листа: первая, где есть хотя бы одно известное имя столбца."""
+    for i, row in enumerate(rows):
+        if any(str(x).strip().lower() in keys for x in row):
+            return i
+    return None
+
+def _xlsx_frame(batch: list[tuple], cols: list[str], start: int) -> pd.DataFrame:
+    """Часть листа -> таблица object; пустые ячейки — NaN, как пропуски при чтении CSV."""
+    arr = np.array(batch, dtype=object)
+    arr[np.equal(arr, None)] = np.nan
+    return pd.DataFrame(arr, columns=cols, index=pd.RangeIndex(start, start + len(batch)))
+
+def iter_xlsx_batches(file_path: Path, keys: set[str], batch_rows: int | None = None,
+                      profile: dict | None = None, found: dict | None = None):
+    """
+    XLSX потоком (read_only): шапка ищется в первых HEADER_SCAN_ROWS строках по мере чтения, дальше строки
+    отдаются частями по batch_rows (столбцы — object, как у таблицы целиком). Шапки нет — ни одной части.
+    Профиль клиента (header_row, columns) проверяется первым: совпала строка — остальные не просматриваем.
+    В found записывается найденное (header_row, columns, via) — для обучения профиля.
+    """
+    batch_rows = batch_rows or XLSX_BATCH_ROWS
+    found = {} if found is None else found
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        ws = wb.active if len(wb.sheetnames) == 1 else wb[wb.sheetnames[0]]
+        rows = ws.iter_rows(values_only=True)
+        hdr = None
+        head: list[tuple] = []
+        known = (profile or {}).get("header_row")
+        if isinstance(known, int) and 0 <= known < HEADER_SCAN_ROWS:
+            head = list(islice(rows, known + 1))
+            if len(head) > known and [str(c).strip().lower() for c in head[known]] == profile.get("columns"):
+                hdr, found["via"] = known, "profile"
+        if hdr is None:
+            head += list(islice(rows, HEADER_SCAN_ROWS - len(head)))
+            hdr, found["via"] = header_index(head, keys), "detect"
+        if hdr is None:
+            return
+        cols = [str(c).strip().lower() for c in head[hdr]]
+        found.update(header_row=hdr, columns=cols)
+        width = len(cols)
+        start = 0
+        batch: list[tuple] = []
+        for row in chain(head[hdr + 1:], rows):
+            if len(row) != width:  # лист без размеров (dimension) — строки разной длины
+                row = (tuple(row) + (None,) * width)[:width]
+            batch.append(row)
+            if len(batch) >= batch_rows:
+                yield _xlsx_frame(batch, cols, start)
+                start += len(batch)
+                batch = []
+        if batch:
+            yield _xlsx_frame(batch, cols, start)
+    finally:
+        wb.close()
+
+def read_xls(file_path: Path) -> pd.DataFrame:
+    # Требуется xlrd для .xls
+    try:
+        return pd.read_excel(file_path, engine="xlrd")
+    except Exception as e:
+        print(f"[WARN] Нужен пакет 'xlrd' для чтения .xls: {e}")
+        try:
+            return pd.read_excel(file_path)
+        except Exception as e2:
+            print(f"[WARN] Не удалось прочитать .xls: {e2}")
+            return pd.DataFrame()
+
+def read_source(src: Path, plan: TransformPlan, tracer, dialect: tuple[str, str] | None = None) -> pd.DataFrame | None:
+    """Исходник -> таблица с нормализованными (strip/lower) именами столбцов; None — читать нечего.
+    dialect — (кодировка, разделитель) CSV, если уже известны (csv_dialect)."""
+    suf = src.suffix.lower()
+    size = src.stat().st_size
+    if suf == ".csv":
+        with tracer.span("read", nbytes=size, format=suf) as m:
+            df = read_csv(src, *(dialect or ()))
+            m["rows"] = len(df)
+        return df
+    if suf == ".xls":
+        with tracer.span("read", nbytes=size, format=suf) as m:
+            df_raw = read_xls(src)
+            m["rows"] = len(df_raw)
+        if df_raw.empty:
+            print(f"[WARN] Пустая таблица XLS: {src}")
+            return None
+        df_raw.columns = [str(c).strip().lower() for c in df_raw.columns]
+        return df_raw
+    print(f"[WARN] Неподдерживаемый формат: {suf}")
+    return None
+
+
+# ========== ЗАДАЧА ==========
+
+def profile_path(spec: ClientSpec, suffix: str) -> Path:
+    return PROFILE_DIR / f"{spec.client_name}_{spec.report_type}_{suffix.lstrip('.').lower()}.json"
+
+def load_profile(path: Path) -> dict | None:
+    """
+    Профиль входного файла клиента — что сработало в прошлый раз: для CSV кодировка, разделитель и шапка,
+    для XLSX номер строки шапки и шапка. Дистрибьютор месяц за месяцем шлет один и тот же макет, поэтому
+    профиль проверяется первым (по шапке), а chardet / поиск шапки нужны только при расхождении.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            profile = json.load(f)
+        return profile if isinstance(profile, dict) else None
+    except (OSError, ValueError):
+        return None
+
+def save_profile(path: Path, profile: dict) -> None:
+    """Профиль пишется после успешной обработки; ошибка записи задачу не валит."""
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")  # задачи одного клиента могут идти параллельно
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(dict(profile, updated=datetime.now().isoformat(timespec="seconds")), f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"[WARN] Не удалось сохранить профиль {path}: {e}")
+
+def load_registry(registry_path: Path) -> pd.DataFrame:
+    return pd.read_csv(registry_path, sep=";", encoding="utf-8-sig")
+
+def write_manifest(paths: list[Path]) -> None:
+    """Сообщаем оркестратору точные пути результатов (TASK_MANIFEST), чтобы он не сканировал OUTPUT_DIR."""
+    manifest = os.getenv("TASK_MANIFEST")
+    if not manifest:
+        return
+    tmp = manifest + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"outputs": [str(p) for p in paths]}, f, ensure_ascii=False)
+    os.replace(tmp, manifest)
+
+def write_batch_manifest(results: dict[str, dict]) -> None:
+    """Итоги пакетного запуска по id (TASK_MANIFEST): {"results": {"<id>": {"outputs": [...], "error": ...}}}."""
+    manifest = os.getenv("TASK_MANIFEST")
+    if not manifest:
+        return
+    tmp = manifest + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"results": results}, f, ensure_ascii=False)
+    os.replace(tmp, manifest)
+
+def load_task(payload: dict | None) -> dict | None:
+    """
+    Строка реестра для задачи: payload от оркестратора (аргумент или TASK_PAYLOAD, JSON).
+    CSV-реестр читаем только при ручном запуске без payload (по TASK_ID).
+    """
+    if payload is None and os.getenv("TASK_PAYLOAD"):
+        payload = json.loads(os.environ["TASK_PAYLOAD"])
+    if payload is not None:
+        return payload
+
+    task_id_env = os.getenv("TASK_ID")
+    if not task_id_env or not task_id_env.isdigit():
+        print("[INFO] TASK_ID не передан оркестратором — нечего делать.")
+        return None
+    task_id = int(task_id_env)
+    registry = load_registry(REESTR_PATH)
+    row_sel = registry[registry["id"].astype(int) == task_id]
+    if row_sel.empty:
+        print(f"[INFO] В CSV нет строки с id={task_id} (реестр обновлён?).")
+        return None
+    return row_sel.iloc[0].to_dict()
+
+def output_format() -> str:
+    """Формат результата: TASK_OUTPUT_FORMAT от оркестратора, иначе OUTPUT_FORMAT (csv по умолчанию)."""
+    return resolve_format(os.getenv("TASK_OUTPUT_FORMAT") or OUTPUT_FORMAT)
+
+def stream_frames(chunks, src: Path, plan: TransformPlan, row: dict, schema: TargetSchema, writer: CsvWriter,
+                  tracer) -> tuple[int, int]:
+    """
+    Исходник частями (iter_csv_chunks / iter_xlsx_batches): часть -> план -> writer; память — одна часть.
+    Span'ы read/transform/write — суммарные по всем частям (first_sec в read — время до первой части).
+    Возвращает (прочитано строк, записано строк); файл результата появляется, только если записано > 0.
+    """
+    spent = {"read": 0.0, "transform": 0.0, "write": 0.0}
+    first_sec = None
+    rows_in = n_chunks = 0
+    try:
+        while True:
+            t0 = time.perf_counter()
+            chunk = next(chunks, None)
+            spent["read"] += time.perf_counter() - t0
+            if chunk is None:
+                break
+            if first_sec is None:
+                first_sec = round(spent["read"], 4)
+            rows_in += len(chunk)
+            n_chunks += 1
+            t0 = time.perf_counter()
+            out = plan.apply(chunk, row, schema)
+            del chunk
+            spent["transform"] += time.perf_counter() - t0
+            if out is None:
+                continue
+            t0 = time.perf_counter()
+            writer.write(out)
+            spent["write"] += time.perf_counter() - t0
+        if writer.rows:
+            t0 = time.perf_counter()
+            writer.close()
+            spent["write"] += time.perf_counter() - t0
+        else:
+            writer.abort()
+    except BaseException:
+        chunks.close()
+        writer.abort()
+        raise
+    tracer.emit("read", spent["read"], rows=rows_in, nbytes=src.stat().st_size, format=src.suffix.lower(),
+                chunks=n_chunks, first_sec=first_sec)
+    tracer.emit("transform", spent["transform"], rows=writer.rows)
+    if writer.rows:
+        tracer.emit("write", spent["write"], rows=writer.rows, nbytes=writer.out_path.stat().st_size,
+                    format=writer.format)
+    return rows_in, writer.rows
+
+def run_client(plan: TransformPlan, payload: dict | None = None, import_sec: float | None = None) -> None:
+    """Одна запись реестра (TASK_ID) -> один итоговый файл (CSV / Parquet / Arrow) в OUTPUT_DIR + манифест.
+    Манифест пишется и без результата ({"outputs": []}): иначе оркестратор искал бы файлы id в OUTPUT_DIR
+    и мог бы взять старый файл прошлого запуска."""
+    tracer = task_tracer()
+    if import_sec is not None:
+        tracer.emit("import", import_sec)
+
+    row = load_task(payload)
+    out_path = process_row(plan, row, tracer) if row is not None else None
+    write_manifest([out_path] if out_path is not None else [])
+
+def run_batch(plan: TransformPlan, payloads: list[dict] | None = None, import_sec: float | None = None) -> None:
+    """
+    Пакетный запуск (TASK_IDS): строки реестра (payloads или TASK_PAYLOADS, JSON-список) по очереди в одном процессе —
+    импорт, план и схема один раз на пакет. Ошибка строки не останавливает пакет: итог по каждому id
+    ({"outputs": [...]} или {"outputs": [], "error": ...}) дописывается в манифест сразу после строки,
+    так что при таймауте или падении процесса готовые итоги сохраняются.
+    """
+    if payloads is None:
+        payloads = json.loads(os.getenv("TASK_PAYLOADS") or "[]")
+    results: dict[str, dict] = {}
+    for i, row in enumerate(payloads):
+        task_id = int(row["id"])
+        tracer = task_tracer(task_id=task_id)
+        if i == 0 and import_sec is not None:
+            tracer.emit("import", import_sec)
+        try:
+            out_path = process_row(plan, row, tracer)
+            results[str(task_id)] = {"outputs": [str(out_path)] if out_path is not None else []}
+        except Exception as e:
+            traceback.print_exc()
+            print(f"[WARN] id={task_id}: ошибка обработки ({type(e).__name__}: {e}), продолжаю пакет")
+            results[str(task_id)] = {"outputs": [], "error": f"{type(e).__name__}: {e}"}
+        write_batch_manifest(results)
+
+def process_row(plan: TransformPlan, row: dict, tracer) -> Path | None:
+    """Строка реестра -> путь итогового файла (None — результата нет, причина напечатана)."""
+    spec = plan.spec
+    task_id = int(row["id"])
+
+    if str(row["client_name"]) != spec.client_name or str(row["report_type"]) != spec.report_type:
+        print(f"[INFO] id={task_id} не относится к {spec.client_name}/{spec.report_type}. Пропуск.")
+        return None
+
+    src_path = Path(row["file_path"])
+    if not src_path.exists():
+        print(f"[WARN] Файл не найден: {src_path}")
+        return None
+
+    with tracer.span("schema"):
+        schema = load_schema(HEADER_PATH)
+    fmt = output_format()
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    out_path = OUTPUT_DIR / f"{spec.client_name}_id{task_id}_{src_path.stem}_{ts}{OUTPUT_FORMATS[fmt]}"
+
+    suf = src_path.suffix.lower()
+    prof_path = profile_path(spec, suf)
+    profile = load_profile(prof_path) if suf in (".csv", ".xlsx") else None
+    learned = None  # профиль по этому файлу; сохраняется, если файл обработан и профиль изменился
+    dialect = None
+    if suf == ".csv":
+        with tracer.span("detect") as m:
+            enc, sep, m["via"] = csv_dialect(src_path, profile)
+            dialect = (enc, sep)
+            if m["via"] == "detect":
+                columns = csv_header(src_path, enc, sep)
+                learned = dict(encoding=enc, sep=sep, columns=columns) if columns else None
+                if profile:
+                    print(f"[INFO] Файл не совпал с профилем {prof_path.name} — кодировка и разделитель определены заново.")
+
+    if suf == ".xlsx" or (suf == ".csv" and src_path.stat().st_size >= CSV_STREAM_MIN_BYTES):
+        OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        found: dict = {}
+        chunks = (iter_xlsx_batches(src_path, plan.header_keys, profile=profile, found=found) if suf == ".xlsx"
+                  else iter_csv_chunks(src_path, enc=dialect[0], sep=dialect[1]))
+        try:
+            rows_in, rows_out = stream_frames(chunks, src_path, plan, row, schema,
+                                              open_writer(fmt, out_path, schema), tracer)
+            if not rows_in:
+                print(f"[WARN] Не удалось определить шапку/таблица пуста: {src_path}")
+                return None
+            if not rows_out:
+                print(f"[WARN] Пустой результат преобразования для id={task_id}")
+                return None
+            if found.get("via") == "detect":
+                learned = dict(header_row=found["header_row"], columns=found["columns"])
+                if profile:
+                    print(f"[INFO] Шапка не совпала с профилем {prof_path.name} — найдена заново (строка {found['header_row']}).")
+            if learned:
+                save_profile(prof_path, learned)
+            print(f"[OK] Сохранён файл: {out_path}")
+            return out_path
+        except ValueError as e:  # типы столбцов в частях CSV не совпали с первой частью — читаем целиком
+            if suf != ".csv":
+                raise
+            print(f"[WARN] Потоковое чтение не удалось ({e}); читаю файл целиком: {src_path}")
+
+    df = read_source(src_path, plan, tracer, dialect)
+    if df is None or df.empty:
+        print(f"[WARN] Не удалось определить шапку/таблица пуста: {src_path}")
+        return None
+
+    with tracer.span("transform") as m:
+        out = plan.apply(df, row, schema)
+        m["rows"] = 0 if out is None else len(out)
+    del df  # исходная таблица больше не нужна — не держим ее в памяти во время записи
+    if out is None:
+        print(f"[WARN] Пустой результат преобразования для id={task_id}")
+        return None
+
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    with tracer.span("write", format=fmt) as m:
+        writer = open_writer(fmt, out_path, schema)
+        try:
+            writer.write(out)
+            writer.close()
+        except BaseException:
+            writer.abort()
+            raise
+        m["rows"] = len(out)
+        m["nbytes"] = out_path.stat().st_size
+    if learned:
+        save_profile(prof_path, learned)
+    print(f"[OK] Сохранён файл: {out_path}")
+    return out_path
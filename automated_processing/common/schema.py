@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Целевая схема отчета: report_header.xlsx -> TargetSchema (порядок столбцов, типы, обязательность).
+
+Формат report_header.xlsx:
+- строка 1 — имена столбцов в порядке итогового отчета (как и раньше);
+- строка 2 (необязательная) — типы: string | int | float | date, "!" в конце — значение обязательно
+  (например "date!"); пустая ячейка — тип по умолчанию.
+Без строки 2 тип берется по имени (DEFAULT_TYPE_RULES, иначе string), обязательны поля реестра (NOT_NULL_DEFAULT).
+
+Схема компилируется один раз: в процессе — кэш по (mtime, размер) файла, между процессами (каждая задача —
+отдельный запуск скрипта) — файл {шапка}.schema.json рядом с шапкой; при другом mtime он сверяется по sha256
+содержимого и перекомпилируется только при реальном изменении шапки. openpyxl/pandas для этого не нужны.
+"""
+
+import os
+import re
+import json
+import hashlib
+from pathlib import Path
+
+SCHEMA_TYPES = ("string", "int", "float", "date")
+DEFAULT_TYPE_RULES = [
+    (re.compile(r"^amount_type_\d+$"), "float"),
+    (re.compile(r"^sum_"), "float"),
+    (re.compile(r"^(period|date|date_\w+)$"), "date"),
+]
+NOT_NULL_DEFAULT = {"filename_ish", "report_provider_name", "Report_Provaider"}
+SCHEMA_CACHE_SUFFIX = ".schema.json"
+SCHEMA_VERSION = 1  # меняется вместе с форматом кэша
+
+
+class TargetSchema:
+    def __init__(self, columns: list[str], types: dict[str, str], nullable: dict[str, bool]):
+        self.columns = list(columns)
+        self.types = dict(types)
+        self.nullable = dict(nullable)
+
+    def to_dict(self) -> dict:
+        return {"columns": self.columns, "types": self.types, "nullable": self.nullable}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "TargetSchema":
+        return cls(d["columns"], d["types"], d["nullable"])
+
+
+def default_type(name: str) -> str:
+    for pattern, type_ in DEFAULT_TYPE_RULES:
+        if pattern.match(name):
+            return type_
+    return "string"
+
+
+def compile_schema(header_path: str | Path) -> TargetSchema:
+    from openpyxl import load_workbook
+    wb = load_workbook(header_path, read_only=True, data_only=True)
+    try:
+        rows = list(wb.active.iter_rows(min_row=1, max_row=2, values_only=True))
+    finally:
+        wb.close()
+    if not rows:
+        raise ValueError(f"Пустая шапка отчета: {header_path}")
+    names = [str(c).strip() for c in rows[0] if c is not None and str(c).strip()]
+    type_row = list(rows[1]) if len(rows) > 1 else []
+    types, nullable = {}, {}
+    for i, name in enumerate(names):
+        spec = str(type_row[i]).strip().lower() if i < len(type_row) and type_row[i] is not None else ""
+        required = spec.endswith("!")
+        spec = spec.rstrip("!")
+        if spec and spec not in SCHEMA_TYPES:
+            raise ValueError(f"{header_path}: неизвестный тип '{spec}' у столбца {name}")
+        types[name] = spec or default_type(name)
+        nullable[name] = not required if (spec or required) else name not in NOT_NULL_DEFAULT
+    return TargetSchema(names, types, nullable)
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+_schemas: dict[str, tuple[int, int, TargetSchema]] = {}
+
+def load_schema(header_path: str | Path) -> TargetSchema:
+    """Скомпилированная схема шапки; перекомпилируется, только если содержимое файла изменилось."""
+    key = os.path.abspath(header_path)
+    st = os.stat(key)
+    cached = _schemas.get(key)
+    if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+        return cached[2]
+
+    cache_path = key + SCHEMA_CACHE_SUFFIX
+    stored = None
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            stored = json.load(f)
+        if stored.get("version") != SCHEMA_VERSION:
+            stored = None
+    except (OSError, ValueError, AttributeError):
+        stored = None
+
+    schema = None
+    digest = None
+    if stored and (stored.get("mtime_ns"), stored.get("size")) == (st.st_mtime_ns, st.st_size):
+        schema = TargetSchema.from_dict(stored["schema"])
+    else:
+        digest = _sha256(key)  # mtime другой (копия, checkout) — сверяем содержимое
+        if stored and stored.get("sha256") == digest:
+            schema = TargetSchema.from_dict(stored["schema"])
+        else:
+            schema = compile_schema(key)
+        try:
+            tmp = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"version": SCHEMA_VERSION, "mtime_ns": st.st_mtime_ns, "size": st.st_size,
+                           "sha256": digest, "schema": schema.to_dict()}, f, ensure_ascii=False)
+            os.replace(tmp, cache_path)
+        except OSError:
+            pass  # нет прав на запись рядом с шапкой — просто компилируем в каждом процессе
+    _schemas[key] = (st.st_mtime_ns, st.st_size, schema)
+    return schema
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+spec_runner.py — клиентский скрипт для клиентов, описанных спецификацией ({Client}_spec.json, см. engine.py).
+
+Оркестратор запускает его вместо {Client}_processing.py, если у клиента есть только спецификация,
+и передает путь к ней в TASK_SPEC. Ручной запуск: TASK_ID=<id> python spec_runner.py <путь к spec.json>.
+Пакетный запуск: TASK_IDS (id через запятую) и TASK_PAYLOADS — строки обрабатываются в одном процессе (run_batch);
+оркестратор отдает пакеты только скриптам с SUPPORTS_BATCH = True.
+"""
+
+import time
+_IMPORT_T0 = time.perf_counter()  # импорт библиотек — отдельная фаза трассировки
+
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # automated_processing: общий код
+from common.engine import load_plan, run_batch, run_client
+
+_IMPORT_SEC: float | None = time.perf_counter() - _IMPORT_T0
+SUPPORTS_BATCH = True  # пакетный контракт (TASK_IDS/TASK_PAYLOADS) — оркестратор ищет это присваивание
+
+def main(payload: dict | None = None, spec_path: str | None = None):
+    global _IMPORT_SEC
+    spec_path = spec_path or os.getenv("TASK_SPEC")
+    if not spec_path:
+        print("[WARN] Не задан путь спецификации (TASK_SPEC).")
+        sys.exit(2)
+    import_sec, _IMPORT_SEC = _IMPORT_SEC, None  # в тёплом воркере модуль импортируется один раз
+    plan = load_plan(spec_path)
+    if payload is None and os.getenv("TASK_IDS"):
+        run_batch(plan, None, import_sec)
+    else:
+        run_client(plan, payload, import_sec)
+
+if __name__ == "__main__":
+    main(spec_path=sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Замеры фаз задачи в формате JSON lines: одна строка — один span.
+
+    {"ts": "...", "source": "client", "task_id": 42, "client": "Client_01",
+     "phase": "transform", "dur_ms": 812.4, "rows": 150000, "bytes": null}
+
+Оркестратор передает скрипту TASK_TRACE — отдельный файл на задачу (параллельные процессы не пишут
+в один файл); после задачи переносит эти строки в общий трейс и, если включено, в ops.task_metrics.
+Без пути Tracer ничего не пишет — скрипт можно запускать вручную как раньше.
+Трассировка не мешает обработке: ошибка записи span'а (диск, права на TRACE_DIR) или приемника — только WARN.
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class Tracer:
+    """
+    Пишет span'ы в path (дописывая). static — поля, общие для всех span'ов (node, source, ...);
+    on_span(span) — дополнительный приемник (например, буфер для записи в БД).
+    Ошибки записи не пробрасываются: WARN через log — один раз, пока запись снова не пройдет.
+    """
+
+    def __init__(self, path: str | None, on_span=None, log=print, **static):
+        self.path = path
+        self.on_span = on_span
+        self.log = log
+        self.static = static
+        self._lock = threading.Lock()
+        self._failing: set[str] = set()  # "file" / "sink" — о чем уже предупредили
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path) or self.on_span is not None
+
+    def emit(self, phase: str, dur_sec: float, rows: int | None = None, nbytes: int | None = None,
+             started: datetime | None = None, **fields) -> None:
+        if not self.enabled:
+            return
+        span = dict(self.static)
+        span.update(fields)
+        span.update(
+            ts=(started or datetime.now().astimezone()).isoformat(timespec="milliseconds"),
+            phase=phase,
+            dur_ms=round(dur_sec * 1000, 3),
+            rows=rows,
+            bytes=nbytes,
+        )
+        self.write(span)
+
+    def write(self, span: dict) -> None:
+        """Готовый span (например, прочитанный из файла задачи) -> в файл и приемник."""
+        if self.path:
+            line = json.dumps(span, ensure_ascii=False, default=str) + "\n"
+            with self._lock:
+                try:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(line)
+                    self._failing.discard("file")
+                except OSError as e:
+                    self._warn("file", f"span'ы не пишутся в {self.path}: {e}")
+        if self.on_span is not None:
+            try:
+                self.on_span(span)
+            except Exception as e:
+                with self._lock:
+                    self._warn("sink", f"приемник span'ов: {e}")
+            else:
+                self._failing.discard("sink")
+
+    def _warn(self, kind: str, msg: str) -> None:
+        if kind not in self._failing:
+            self._failing.add(kind)
+            self.log(f"[WARN] Трассировка: {msg}")
+
+    @contextmanager
+    def span(self, phase: str, **fields):
+        """
+        with tracer.span("read", nbytes=size) as m:
+            df = ...
+            m["rows"] = len(df)
+        Исключение внутри блока тоже фиксируется (поле error) и пробрасывается дальше.
+        """
+        m = dict(fields)
+        started = datetime.now().astimezone()
+        t0 = time.perf_counter()
+        try:
+            yield m
+        except BaseException as e:
+            m["error"] = type(e).__name__
+            raise
+        finally:
+            self.emit(phase, time.perf_counter() - t0, m.pop("rows", None), m.pop("nbytes", None),
+                      started=started, **m)
+
+
+def task_tracer(source: str = "client", task_id: int | None = None) -> Tracer:
+    """Tracer задачи из окружения оркестратора (TASK_TRACE, TASK_ID, TASK_CLIENT); в пакетном запуске id задается явно."""
+    task_id = os.getenv("TASK_ID") if task_id is None else str(task_id)
+    return Tracer(os.getenv("TASK_TRACE") or None, source=source,
+                  task_id=int(task_id) if task_id and task_id.isdigit() else task_id,
+                  client=os.getenv("TASK_CLIENT") or None)
+
+
+def read_spans(path: str) -> list[dict]:
+    """Span'ы из файла задачи; битые строки (процесс убит на середине записи) пропускаем."""
+    spans = []
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    spans.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return spans
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Запись итогового отчета: CSV (по умолчанию), Parquet или Arrow IPC (OUTPUT_FORMATS).
+
+Писатель принимает кадры результата по одному (целиком или частями при потоковом чтении) и пишет
+в {файл}.part; close() переименовывает готовый файл, abort() удаляет недописанный.
+
+Parquet / Arrow — столбцы с типами целевой схемы (common/schema.py): string, int64, float64, date32.
+Значение, которое не приводится к типу столбца, становится пустым (null); пустое значение
+в обязательном столбце — OutputSchemaError. Нужен pyarrow; без него open_writer пишет CSV с предупреждением.
+"""
+
+import os
+import csv
+from pathlib import Path
+
+import pandas as pd
+
+from common.schema import TargetSchema
+
+OUTPUT_FORMATS = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+PARQUET_COMPRESSION = "zstd"
+DATE_FORMAT = "%d.%m.%Y"  # в таком виде даты приходят из правила date (out_format по умолчанию)
+
+
+class OutputSchemaError(Exception):
+    """Результат не укладывается в целевую схему (пустое обязательное поле)."""
+
+
+def part_path(out_path: Path) -> Path:
+    """Файл, в который идет запись; в out_path переименовывается целиком готовый результат
+    (оркестратор не подберет недописанный файл: .part не входит в OUTPUT_EXTENSIONS)."""
+    return out_path.with_name(out_path.name + ".part")
+
+
+class CsvWriter:
+    format = "csv"
+
+    def __init__(self, out_path: Path, schema: TargetSchema):
+        self.out_path = out_path
+        self.tmp = part_path(out_path)
+        self.rows = 0
+        self._f = open(self.tmp, "w", encoding="utf-8-sig", newline="")
+
+    def write(self, out: pd.DataFrame) -> None:
+        out.to_csv(self._f, sep=";", index=False, header=self.rows == 0, quoting=csv.QUOTE_MINIMAL)
+        self.rows += len(out)
+
+    def _finish(self) -> None:
+        self._f.close()
+
+    def close(self) -> Path:
+        self._finish()
+        os.replace(self.tmp, self.out_path)
+        return self.out_path
+
+    def abort(self) -> None:
+        try:
+            self._finish()
+        finally:
+            self.tmp.unlink(missing_ok=True)
+
+
+def _arrow_type(pa, type_: str):
+    return {"string": pa.string(), "int": pa.int64(), "float": pa.float64(), "date": pa.date32()}[type_]
+
+
+def _to_arrow(pa, s: pd.Series, type_: str):
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        # категория (поля реестра, справочные столбцы, даты): приводим только различные значения
+        cats = _to_arrow(pa, pd.Series(s.cat.categories, dtype=object), type_)
+        codes = s.cat.codes.to_numpy()
+        return cats.take(pa.array(codes, mask=codes < 0))
+    if type_ == "string":
+        if not isinstance(s.dtype, pd.StringDtype):
+            s = s.astype("string")
+        return pa.array(s.array, type=pa.string())
+    if type_ in ("int", "float"):
+        num = s if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s) \
+            else pd.to_numeric(s.astype(object), errors="coerce")
+        if type_ == "int":
+            num = num.where(num % 1 == 0).astype("Int64")  # дробное в целом столбце -> null
+            return pa.array(num.array, type=pa.int64())
+        return pa.array(num.astype("float64").to_numpy(), type=pa.float64(), from_pandas=True)
+    dates = s if pd.api.types.is_datetime64_any_dtype(s) else \
+        pd.to_datetime(s.astype(object), format=DATE_FORMAT, errors="coerce")
+    return pa.array(dates.dt.date.to_numpy(dtype=object, na_value=None), type=pa.date32())
+
+
+class ArrowWriter(CsvWriter):
+    """Parquet (ParquetWriter, группа строк на кадр) или Arrow IPC (file format) по схеме отчета."""
+
+    def __init__(self, out_path: Path, schema: TargetSchema, fmt: str):
+        import pyarrow as pa
+        self.pa = pa
+        self.format = fmt
+        self.out_path = out_path
+        self.tmp = part_path(out_path)
+        self.rows = 0
+        self.schema = schema
+        self.arrow_schema = pa.schema([pa.field(name, _arrow_type(pa, schema.types[name]), schema.nullable[name])
+                                       for name in schema.columns])
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            self._w = pq.ParquetWriter(str(self.tmp), self.arrow_schema, compression=PARQUET_COMPRESSION)
+        else:
+            self._sink = pa.OSFile(str(self.tmp), "wb")
+            self._w = pa.ipc.new_file(self._sink, self.arrow_schema)
+
+    def write(self, out: pd.DataFrame) -> None:
+        arrays = []
+        for field in self.arrow_schema:
+            arr = _to_arrow(self.pa, out[field.name], self.schema.types[field.name])
+            if not field.nullable and arr.null_count:
+                raise OutputSchemaError(f"Пустые значения в обязательном столбце {field.name}: {arr.null_count}")
+            arrays.append(arr)
+        self._w.write_table(self.pa.Table.from_arrays(arrays, schema=self.arrow_schema))
+        self.rows += len(out)
+
+    def _finish(self) -> None:
+        self._w.close()
+        if self.format == "arrow":
+            self._sink.close()
+
+
+def open_writer(fmt: str, out_path: Path, schema: TargetSchema) -> CsvWriter:
+    """Писатель для формата; out_path — с расширением формата (OUTPUT_FORMATS)."""
+    if fmt == "csv":
+        return CsvWriter(out_path, schema)
+    return ArrowWriter(out_path, schema, fmt)
+
+
+def resolve_format(fmt: str | None) -> str:
+    """Формат, который реально будет записан: неизвестный или без pyarrow -> csv (с предупреждением)."""
+    fmt = (fmt or "csv").strip().lower()
+    if fmt not in OUTPUT_FORMATS:
+        print(f"[WARN] Неизвестный формат результата '{fmt}' — пишу CSV.")
+        return "csv"
+    if fmt != "csv":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print(f"[WARN] Для формата {fmt} нужен пакет pyarrow — пишу CSV.")
+            return "csv"
+    return fmt
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Фоновый перенос итоговых файлов FINAL_DIR -> LOAD_DIR.
+
+Перенос идет в отдельных потоках и перекрывается с выполнением следующих скриптов: задача отдает
+свои файлы BackgroundMover.submit(...) и освобождает поток пула, а статус ставится колбэком,
+когда все файлы задачи перенесены (или попытки исчерпаны).
+
+- быстрый путь: os.rename в пределах тома; между томами — копирование (shutil.move);
+- коллизия имен: сначала размер, затем хэш первых/последних PARTIAL_BYTES, и только при совпадении —
+  полный sha256; хэши файлов LOAD_DIR запоминаются по (путь, размер, mtime);
+- занятый файл не держит очередь: повтор планируется с экспоненциальной паузой и случайным
+  разбросом (jitter), остальные файлы переносятся в это время.
+"""
+
+import os
+import heapq
+import random
+import shutil
+import hashlib
+import itertools
+import threading
+import time
+from pathlib import Path
+
+PARTIAL_BYTES = 64 * 1024
+LOCK_WINERRORS = (5, 32, 33)   # access denied / sharing violation
+EXDEV_WINERROR = 17            # ERROR_NOT_SAME_DEVICE
+
+
+def _sha256_file(path: Path, chunk: int = 2**20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            b = f.read(chunk)
+            if not b:
+                break
+            h.update(b)
+    return h.hexdigest()
+
+
+def _partial_hash(path: Path, size: int) -> str:
+    """Хэш начала и конца файла — дешевая проверка перед полным хэшированием."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        h.update(f.read(PARTIAL_BYTES))
+        if size > 2 * PARTIAL_BYTES:
+            f.seek(size - PARTIAL_BYTES)
+        h.update(f.read(PARTIAL_BYTES))
+    return h.hexdigest()
+
+
+class _Job:
+    __slots__ = ("task_id", "remaining", "moved", "last_reason", "on_done")
+
+    def __init__(self, task_id: int, count: int, on_done):
+        self.task_id = task_id
+        self.remaining = count
+        self.moved = 0
+        self.last_reason = "OK"
+        self.on_done = on_done
+
+
+class BackgroundMover:
+    """
+    Очередь переносов с отложенными повторами. on_done(moved, last_reason) вызывается в потоке
+    переносчика, когда по задаче обработаны все файлы.
+    """
+
+    def __init__(self, load_dir: str, max_retries: int, base_sleep: float, max_sleep: float,
+                 workers: int = 2, log=print):
+        self.load_dir = Path(load_dir)
+        self.max_retries = max(1, max_retries)
+        self.base_sleep = base_sleep
+        self.max_sleep = max_sleep
+        self.log = log
+        self._heap: list = []                 # (когда, порядковый №, задача, файл, попытка)
+        self._seq = itertools.count()
+        self._jobs: dict[int, _Job] = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._hashes: dict[tuple, str] = {}   # (путь, размер, mtime) -> sha256 для файлов LOAD_DIR
+        self._hash_lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._worker, name=f"mover-{i}", daemon=True)
+                         for i in range(max(1, workers))]
+        for t in self._threads:
+            t.start()
+
+    # --- API ---
+
+    def submit(self, task_id: int, files: list[Path], on_done) -> None:
+        if not files:
+            on_done(0, "NO_OUTPUT_FILE")
+            return
+        job = _Job(task_id, len(files), on_done)
+        with self._cond:
+            self._jobs[task_id] = job
+            now = time.monotonic()
+            for src in files:
+                heapq.heappush(self._heap, (now, next(self._seq), job, Path(src), 0))
+            self._cond.notify_all()
+
+    def owns(self, task_id: int) -> bool:
+        """Задача еще ждет переноса своих файлов."""
+        with self._cond:
+            return task_id in self._jobs
+
+    def drain(self) -> None:
+        """Ждем, пока все отданные задачи получат результат."""
+        with self._cond:
+            while self._jobs:
+                self._cond.wait()
+
+    def close(self) -> None:
+        self.drain()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join()
+
+    # --- потоки ---
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed and not self._heap:
+                        return
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        _, _, job, src, attempt = heapq.heappop(self._heap)
+                        break
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+
+            try:
+                outcome, reason, _ = self.move_once(src)
+            except Exception as e:  # поток переносчика не должен падать: иначе drain() не дождется задачи
+                outcome, reason = "fail", f"MOVE_ERROR:{e}"
+            if outcome == "retry" and attempt + 1 < self.max_retries:
+                delay = min(self.max_sleep, self.base_sleep * 2 ** attempt) * random.uniform(0.5, 1.0)
+                with self._cond:
+                    heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), job, src, attempt + 1))
+                    self._cond.notify_all()
+                continue
+            if outcome != "ok":
+                self.log(f"   WARN: id={job.task_id} не смог перенести '{src.name}' -> {reason}")
+            self._finish_file(job, outcome == "ok", reason)
+
+    def _finish_file(self, job: _Job, ok: bool, reason: str) -> None:
+        with self._cond:
+            job.remaining -= 1
+            job.moved += int(ok)
+            job.last_reason = reason
+            finished = job.remaining == 0
+        if not finished:
+            return
+        try:
+            job.on_done(job.moved, job.last_reason)
+        except Exception as e:
+            self.log(f"[WARN] id={job.task_id}: ошибка при завершении переноса: {e}")
+        finally:
+            with self._cond:
+                self._jobs.pop(job.task_id, None)
+                self._cond.notify_all()
+
+    # --- перенос одного файла ---
+
+    def _dst_hash(self, path: Path, st: os.stat_result) -> str:
+        memo_key = (str(path), st.st_size, st.st_mtime_ns)
+        with self._hash_lock:
+            cached = self._hashes.get(memo_key)
+        if cached is None:
+            cached = _sha256_file(path)
+            with self._hash_lock:
+                self._hashes[memo_key] = cached
+        return cached
+
+    def same_content(self, src: Path, dst: Path) -> bool:
+        src_st, dst_st = src.stat(), dst.stat()
+        if src_st.st_size != dst_st.st_size:
+            return False
+        if _partial_hash(src, src_st.st_size) != _partial_hash(dst, dst_st.st_size):
+            return False
+        return _sha256_file(src) == self._dst_hash(dst, dst_st)
+
+    def move_once(self, src: Path) -> tuple[str, str, Path | None]:
+        """Одна попытка переноса -> ("ok" | "retry" | "fail", причина, итоговый путь)."""
+        self.load_dir.mkdir(parents=True, exist_ok=True)
+        dst = self.load_dir / src.name
+
+        if dst.exists():
+            try:
+                if self.same_content(src, dst):
+                    return "ok", "ALREADY_PRESENT", dst
+            except OSError:
+                pass
+            root, ext = os.path.splitext(src.name)
+            dst = self.load_dir / f"{root}_{int(time.time())}{ext}"
+
+        try:
+            try:
+                os.rename(src, dst)          # тот же том — мгновенно
+            except OSError as e:
+                if e.errno != 18 and getattr(e, "winerror", None) != EXDEV_WINERROR:
+                    raise
+                shutil.move(str(src), str(dst))  # другой том — копирование
+            return "ok", "OK", dst
+        except PermissionError:
+            return "retry", "LOCKED", None
+        except OSError as e:
+            winerr = getattr(e, "winerror", None)
+            if winerr in LOCK_WINERRORS:
+                return "retry", "LOCKED", None
+            if winerr == 206:          # path too long
+                return "fail", "PATH_TOO_LONG", None
+            if e.errno in (28,):       # no space
+                return "fail", "NO_SPACE", None
+            return "fail", f"OSERROR:{e.errno or winerr}", None
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Кэш результатов клиентских скриптов.
+
+Ключ — sha256 от (содержимое исходного файла, клиентский скрипт, эталонная шапка report_header.xlsx,
+поля строки реестра, которые попадают в результат: путь файла, клиент, провайдер, тип отчета).
+Если ничего из этого не менялось, результат будет тем же, и запускать скрипт не нужно:
+- успех: в записи лежат копии итоговых файлов (жесткие ссылки, если том тот же); при попадании они
+  восстанавливаются в "Итоговые отчеты" под новым id (_id{старый}_ -> _id{новый}_);
+- детерминированная ошибка (RETURN_CODE_1 — скрипт сам сообщил об ошибке: необработанное исключение или ошибка
+  строки в манифесте пакета): повторно не запускаем, сразу ставим ту же причину. Прочие коды (sys.exit(2) без
+  зависимости, коды аварий Windows > 255, падение тёплого воркера) — не про данные, их повторяем.
+  Пустой результат (NO_OUTPUT_FILE) не кэшируется — обычно это строка, зарегистрированная с чужим клиентом
+  или типом отчета, и после исправления регистрации скрипт должен отработать заново.
+
+Запись: CACHE_DIR/{ключ[:2]}/{ключ}/meta.json (+ файлы результатов). mtime meta.json — время последнего
+использования; evict() удаляет записи старше max_age_days и самые давно использованные сверх max_mb.
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+
+META_NAME = "meta.json"
+
+
+def _sha256_file(path: str, chunk: int = 2**20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            b = f.read(chunk)
+            if not b:
+                break
+            h.update(b)
+    return h.hexdigest()
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def is_deterministic_failure(reason: str) -> bool:
+    """Ошибки, которые повторятся на тех же данных: скрипт сам сообщил об ошибке (код 1 — исключение Python)."""
+    return reason == "RETURN_CODE_1"  # сигнал/OOM (< 0), аварии процесса (> 255), sys.exit(N) — не про данные
+
+
+class ResultCache:
+    def __init__(self, cache_dir: str, header_path: str, max_age_days: float, max_mb: float):
+        self.cache_dir = cache_dir
+        self.header_path = header_path
+        self.max_age_days = max_age_days
+        self.max_mb = max_mb
+        self._hashes: dict[tuple, str] = {}  # (путь, размер, mtime) -> sha256
+        self._lock = threading.Lock()
+
+    # --- ключ ---
+
+    def _file_hash(self, path: str) -> str:
+        st = os.stat(path)
+        memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            cached = self._hashes.get(memo_key)
+        if cached is None:
+            cached = _sha256_file(path)
+            with self._lock:
+                self._hashes[memo_key] = cached
+        return cached
+
+    def key_for(self, source_path: str, script_path: str, extra_paths: tuple[str, ...] = (),
+                variant: str = "", fields: dict | None = None) -> str | None:
+        """Ключ записи или None, если какой-то из файлов недоступен (тогда кэш не используем).
+        variant — параметры запуска, от которых зависит результат (формат вывода);
+        fields — поля строки реестра, которые скрипт читает или переносит в результат."""
+        try:
+            parts = [self._file_hash(p) for p in (source_path, script_path, self.header_path, *extra_paths)]
+        except OSError:
+            return None
+        if variant:
+            parts.append(variant)
+        if fields:
+            parts.append(json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str))
+        return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    # --- чтение ---
+
+    def lookup(self, key: str | None) -> dict | None:
+        if key is None:
+            return None
+        entry = self._entry_dir(key)
+        meta_path = os.path.join(entry, META_NAME)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("status") == "ok":
+            if not all(os.path.isfile(os.path.join(entry, n)) for n in meta.get("outputs", [])):
+                return None
+        try:
+            os.utime(meta_path)  # отметка последнего использования (для вытеснения)
+        except OSError:
+            pass
+        meta["entry"] = entry
+        return meta
+
+    def restore(self, meta: dict, task_id: int, dest_dir: str) -> list[Path]:
+        """Кладет закэшированные файлы в dest_dir под новым id; возвращает их пути."""
+        old_tag = re.compile(rf'([_\-])id{meta.get("task_id")}(?=[_\.\-]|$)', re.IGNORECASE)
+        restored = []
+        for name in meta.get("outputs", []):
+            new_name = old_tag.sub(rf"\g<1>id{task_id}", name, count=1)
+            dst = os.path.join(dest_dir, new_name)
+            if not os.path.exists(dst):
+                _link_or_copy(os.path.join(meta["entry"], name), dst)
+                os.utime(dst)  # свежий mtime: фоновая очистка FINAL_DIR не должна принять его за старый
+            restored.append(Path(dst))
+        return restored
+
+    # --- запись ---
+
+    def _write_entry(self, key: str, meta: dict, files: list[Path]) -> None:
+        entry = self._entry_dir(key)
+        if os.path.isdir(entry):
+            return
+        tmp = f"{entry}.tmp{os.getpid()}_{threading.get_ident()}"
+        try:
+            os.makedirs(tmp, exist_ok=True)
+            for p in files:
+                _link_or_copy(str(p), os.path.join(tmp, p.name))
+            with open(os.path.join(tmp, META_NAME), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.rename(tmp, entry)
+        except OSError:
+            pass  # запись уже создана параллельной задачей или нет места — кэш необязателен
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def store_success(self, key: str | None, task_id: int, files: list[Path]) -> None:
+        if key is None or not files:
+            return
+        meta = dict(status="ok", task_id=task_id, outputs=[p.name for p in files], created=time.time())
+        self._write_entry(key, meta, files)
+
+    def store_failure(self, key: str | None, task_id: int, reason: str) -> None:
+        if key is None or not is_deterministic_failure(reason):
+            return
+        self._write_entry(key, dict(status="fail", task_id=task_id, reason=reason, created=time.time()), [])
+
+    # --- вытеснение ---
+
+    def evict(self) -> tuple[int, float]:
+        """Удаляет устаревшие записи и самые давно использованные сверх лимита. -> (удалено, МБ в кэше)."""
+        if not os.path.isdir(self.cache_dir):
+            return 0, 0.0
+        cutoff = time.time() - self.max_age_days * 86400
+        entries = []  # (последнее использование, размер, путь)
+        removed = 0
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.is_dir():
+                    continue
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                    try:
+                        used = os.stat(os.path.join(entry.path, META_NAME)).st_mtime
+                    except FileNotFoundError:
+                        used = entry.stat().st_mtime  # запись еще пишется (или брошена) — по возрасту каталога
+                except OSError:
+                    continue
+                if used < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    removed += 1
+                else:
+                    entries.append((used, size, entry.path))
+
+        total = sum(e[1] for e in entries)
+        limit = self.max_mb * 2**20
+        for used, size, path in sorted(entries):
+            if total <= limit:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed, total / 2**20
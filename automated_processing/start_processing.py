@@ -3,30 +3,77 @@
 Оркестратор обработки входных файлов.
 
 Пайплайн (укороченно):
-1) Захватываем advisory lock в Postgres (единственный запуск).
-2) (Опционально) чистим "Итоговые отчеты" от старых артефактов.
-3) Читаем из БД ops.file_registry записи со статусами NEW/PROCESSING/ERROR и делаем CSV (read-only).
+1) Готовим служебную схему (колонки аренды, журнал статусов).
+2) Фоном, параллельно с задачами, чистим "Итоговые отчеты" от старых артефактов (os.scandir, с бюджетом
+   CLEANUP_MAX_FILES / CLEANUP_MAX_SEC за проход — большой завал разбирается за несколько запусков).
+3) Захватываем пачками записи ops.file_registry со статусами NEW/PROCESSING/ERROR
+   (SELECT ... FOR UPDATE SKIP LOCKED + аренда claimed_by/lease_until): несколько хостов с оркестратором
+   разбирают очередь одновременно, не пересекаясь; аренды продлеваются heartbeat'ом, просроченные аренды
+   упавшего узла забираются автоматически. Пачки идут по курсору (uploaded_at, id), первая уходит в работу сразу.
+   Захваченное пишем в CSV (read-only, только для просмотра: скрипт получает свою строку в TASK_PAYLOAD).
 4) Для каждой строки:
-   4.1) Находим клиентский скрипт. Если нет — ставим PROCESSING (reason=NO_SCRIPT_FOUND), идем дальше.
-   4.2) Ставим PROCESSING (reason=NULL), запускаем клиентский скрипт (передаем TASK_ID в env).
-   4.3) При успехе ищем файлы для данного id, переносим в "Данные на загрузку".
+   4.1) Находим клиентский скрипт ({Client}_processing.py или спецификацию {Client}_spec.json — ее выполняет
+        common/spec_runner.py). Если нет — ставим PROCESSING (reason=NO_SCRIPT_FOUND), идем дальше.
+        Если вход, скрипт, шапка и поля регистрации не менялись с прошлой обработки (кэш по sha256, см. result_cache.py) —
+        берем готовый результат или прошлую детерминированную ошибку, скрипт не запускаем.
+   4.2) Ставим PROCESSING (reason=NULL), запускаем клиентский скрипт (передаем TASK_ID в env):
+        в тёплом воркере (EXEC_MODE="warm", см. warm_workers.py) или отдельным интерпретатором.
+        Подряд идущие строки одного клиента со скриптом, объявившим SUPPORTS_BATCH = True (common/spec_runner.py),
+        отдаются одним запуском — до BATCH_MAX_TASKS строк; итог по каждому id скрипт пишет в манифест.
+   4.3) При успехе берем файлы для данного id из манифеста скрипта (TASK_MANIFEST), без манифеста —
+        из индекса "Итоговых отчетов"; переносим в "Данные на загрузку" (фоном, см. file_mover.py).
         - если перенесли >=1 — ставим CREATED, error_reason=NULL
         - иначе — ставим ERROR (reason=NO_OUTPUT_FILE)
-   4.4) При неуспехе — ставим ERROR (reason по коду/исключению).
-5) Освобождаем advisory lock.
+        При LOAD_MODE="copy" CSV-результаты вместо переноса грузятся в STAGING_TABLE (COPY, см. bulk_loader.py)
+        одной транзакцией с CREATED; при ошибке загрузки — ERROR (reason=LOAD_ERROR:...).
+   4.4) При неуспехе — ставим ERROR (reason по коду/исключению), attempt_count + 1 и next_attempt_at
+        по причине: TIMEOUT/LOCKED — скоро, прочее — с экспоненциальной паузой; после RETRY_MAX_ATTEMPTS — FAILED.
+        NO_SCRIPT_FOUND ждет изменения каталога скриптов. В очередь попадают только строки, чей срок наступил.
+   Статусы пишет StatusWriter: пачками, одной транзакцией, с журналом переходов (ops.file_status_journal);
+   PROCESSING перед запуском скрипта фиксируется в БД сразу.
+   Строки выполняются пулом до MAX_WORKERS задач одновременно, с лимитами CLIENT_MAX_PARALLEL
+   по client_name; статус, поиск и перенос файлов идут строго по своему id.
+5) Финальный статус снимает аренду; при выходе отпускаем аренды незавершенных строк.
+6) Фазы (подключение, захват, кэш, скрипт, поиск результатов, перенос или загрузка; в скрипте — импорт, схема,
+   кодировка и разделитель CSV, чтение, преобразование, запись) пишутся span'ами в TRACE_DIR (JSON lines),
+   при TRACE_TO_DB — и в ops.task_metrics.
+
+Режимы: разовый запуск по расписанию (по умолчанию) или демон (--daemon): LISTEN на канал,
+в который триггер ops.file_registry шлет id новых строк, + периодический полный проход. Уведомления,
+пришедшие во время прохода, разбираются сразу — новые строки идут в свободные потоки пула.
 """
 
 import os
 import re
+import ast
+import math
+import select
+import argparse
 import csv
+import json
 import sys
 import time
-import shutil
+import socket
+import itertools
 import hashlib
+import threading
+import traceback
 import subprocess
-from datetime import datetime, timedelta
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+
+from common.schema import load_schema
+from common.trace import Tracer, read_spans
+from bulk_loader import BulkLoader, LoadError
+from file_mover import BackgroundMover
+from result_cache import ResultCache
+from task_output import run_streaming
+from warm_workers import WarmWorkerPool
 
 # --- Безопасный вывод: никогда не падаем на символах из-за локали ---
 try:
@@ -44,6 +91,12 @@ TMP_NAME = OUTPUT_NAME + ".tmp"
 SCRIPTS_BASE = r"C:\Users\user\Desktop\Python_scripts\automated_processing\Scripts"
 FINAL_DIR = r"C:\Users\user\Desktop\Итоговые отчеты"       # сюда пишут клиентские скрипты
 LOAD_DIR  = r"C:\Users\user\Desktop\Данные на загрузку"    # сюда переносим валидные файлы
+MANIFEST_DIR = os.path.join(REESTR_DIR, "manifests")         # сюда скрипты пишут пути своих результатов
+HEADER_PATH = r"C:\Users\user\Desktop\Python_scripts\automated_processing\report_header\report_header.xlsx"
+CACHE_DIR = r"C:\Users\user\Desktop\Python_scripts\automated_processing\Cache"  # кэш результатов по хэшу входа
+COMMON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "common")  # общий движок клиентов
+SPEC_RUNNER = os.path.join(COMMON_DIR, "spec_runner.py")  # скрипт для клиентов, описанных только {Client}_spec.json
+OUTPUT_EXTENSIONS = (".csv", ".xlsx", ".xls", ".parquet", ".arrow")  # результаты скриптов; недописанные (*.part) без манифеста не берем
 
 # === ПОДКЛЮЧЕНИЕ К БД ===
 DB = dict(
@@ -59,16 +112,147 @@ STAT_NEW        = "NEW"
 STAT_PROC       = "PROCESSING"
 STAT_CREATED    = "CREATED"
 STAT_ERROR      = "ERROR"
-ALLOWED_STATUSES = {STAT_NEW, STAT_PROC, STAT_CREATED, STAT_ERROR}
+STAT_FAILED     = "FAILED"         # терминальный: попытки исчерпаны, автоматически больше не берем
+ALLOWED_STATUSES = {STAT_NEW, STAT_PROC, STAT_CREATED, STAT_ERROR, STAT_FAILED}
 
 # === ПАРАМЕТРЫ ИСПОЛНЕНИЯ ===
 PYTHON_EXE = sys.executable
-SCRIPT_TIMEOUT_SEC = 1800          # таймаут клиентского скрипта (30 мин)
-ADVISORY_KEY = 84215045            # любой фиксированный int64
+SCRIPT_TIMEOUT_SEC = 1800          # таймаут клиентского скрипта (30 мин); у пакета — на каждую строку пакета...
+BATCH_TIMEOUT_SEC = 2 * SCRIPT_TIMEOUT_SEC  # ...но не больше этого на весь запуск
+BATCH_MAX_TASKS = 20               # не больше N строк одного скрипта в одном запуске (TASK_IDS); 1 — по запуску на строку
 CLEANUP_STRATEGY = "age"           # "age" | "all" — чистить старые файлы или удалять все
 CLEANUP_OLDER_THAN_MIN = 60        # для "age": удалять артефакты старше N минут
+CLEANUP_MAX_FILES = 5000           # бюджет очистки за проход: не больше N файлов...
+CLEANUP_MAX_SEC = 60               # ...и не дольше N сек; остаток дочистится в следующих проходах
 MOVE_MAX_RETRIES = 5               # попытки переноса при временных ошибках
-MOVE_RETRY_SLEEP = 4               # пауза между попытками, сек
+MOVE_RETRY_SLEEP = 4               # начальная пауза между попытками, сек (дальше x2, с разбросом)
+MOVE_RETRY_MAX_SLEEP = 60          # потолок паузы между попытками, сек
+MOVE_WORKERS = 2                   # потоки фонового переноса в LOAD_DIR
+
+# === ЗАГРУЗКА В БД ===
+LOAD_MODE = "move"                 # "move" — перенос файлов в LOAD_DIR | "copy" — COPY CSV в STAGING_TABLE вместе с CREATED
+STAGING_TABLE = "stg.report_rows"  # столбцы шапки отчета (text) + file_id (id реестра), loaded_at
+
+# === ПОВТОРЫ ===
+RETRY_MAX_ATTEMPTS = 8             # после N неудачных попыток строка уходит в FAILED
+RETRY_FAST_SEC = 300               # TIMEOUT / LOCKED — временные помехи, повторяем скоро
+RETRY_BASE_SEC = 900               # прочие ошибки (RETURN_CODE_X, ...): 15 мин, 30 мин, 1 ч, ...
+RETRY_MAX_SEC = 86400              # потолок экспоненциальной паузы
+RETRY_NEVER = datetime(9999, 1, 1, tzinfo=timezone.utc)  # NO_SCRIPT_FOUND: ждем изменения каталога скриптов
+SCRIPTS_SIGNATURE_PATH = os.path.join(REESTR_DIR, "scripts.signature")
+
+# === КЭШ РЕЗУЛЬТАТОВ ===
+CACHE_ENABLED = True               # не запускать скрипт, если вход, скрипт и шапка не менялись
+CACHE_MAX_AGE_DAYS = 30            # записи старше N дней (с последнего использования) удаляются
+CACHE_MAX_MB = 5000                # сверх этого объема удаляются самые давно использованные записи
+
+# === РЕЖИМ ЗАПУСКА СКРИПТОВ ===
+EXEC_MODE = "warm"                 # "warm" — main() в долгоживущих воркерах | "subprocess" — новый интерпретатор на задачу
+WORKER_MAX_TASKS = 50              # воркер перезапускается после N задач...
+WORKER_MAX_RSS_MB = 1500           # ...или если его RSS превысил M МБ
+WORKER_PRELOAD = ("pandas", "openpyxl", "chardet")  # импортируются в воркере один раз
+OUTPUT_FORMAT = "csv"              # формат итогового отчета движка: "csv" | "parquet" | "arrow" (нужен pyarrow)
+OUTPUT_TAIL_CHARS = 1000           # сколько последних символов stdout/stderr скрипта держим в памяти и печатаем
+TASK_LOG_DIR = None                # каталог полного лога каждой задачи (пишется по ходу), например
+                                   # os.path.join(REESTR_DIR, "logs"); None — не писать (без ротации: чистить самим)
+
+# === ТРАССИРОВКА ФАЗ ===
+TRACE_DIR = os.path.join(REESTR_DIR, "trace")  # JSON lines: trace_{узел}_{дата}.jsonl; None — не писать
+TRACE_TO_DB = False                # дублировать span'ы в ops.task_metrics (таблица создается при старте)
+
+# === ЖУРНАЛ СТАТУСОВ ===
+STATUS_FLUSH_SIZE = 500            # переходы статусов пишем пачкой по N записей...
+STATUS_FLUSH_SEC = 5               # ...или если старейший переход ждет дольше N сек
+
+# === ПАРАЛЛЕЛЬНОЕ ИСПОЛНЕНИЕ ===
+MAX_WORKERS = os.cpu_count() or 1  # сколько задач реестра выполнять одновременно; 1 — строго по очереди
+CLIENT_MAX_PARALLEL: dict[str, int] = {
+    # лимит одновременных задач для client_name (крупные файлы не делят память), например:
+    # "Client_01": 1,
+}
+
+# === АРЕНДА СТРОК (несколько узлов) ===
+NODE_ID = f"{socket.gethostname()}:{os.getpid()}"  # кто держит аренду (claimed_by)
+LEASE_SEC = 300                    # аренда строки; продлевается heartbeat'ом, пока узел жив
+LEASE_HEARTBEAT_SEC = 60           # период продления аренд
+CLAIM_BATCH = 2 * MAX_WORKERS      # сколько строк захватывать за раз (берем по мере освобождения пула)
+
+# === РЕЖИМ ДЕМОНА (--daemon) ===
+NOTIFY_CHANNEL = "file_registry_new"  # триггер на ops.file_registry шлет сюда id новых строк
+DAEMON_SWEEP_SEC = 900             # полный проход очереди (пропущенные уведомления, ERROR) раз в N сек
+DAEMON_DEBOUNCE_SEC = 2            # после уведомления ждем N сек, чтобы забрать пачку загруженных подряд файлов
+DAEMON_RECONNECT_SEC = 30          # пауза перед переподключением при потере соединения с БД
+DAEMON_POLL_SEC = 1                # во время прохода проверяем уведомления раз в N сек (новые строки — в свободные потоки)
+DAEMON_ERROR_BACKOFF_SEC = 60      # пауза после прохода, упавшего с ошибкой (демон продолжает работу)
+
+# === СЛУЖЕБНАЯ СХЕМА (создается при старте, идемпотентно) ===
+SCHEMA_DDL = [
+    "ALTER TABLE ops.file_registry ADD COLUMN IF NOT EXISTS status_changed_at timestamptz;",
+    """
+    CREATE TABLE IF NOT EXISTS ops.file_status_journal (
+        journal_id   bigserial PRIMARY KEY,
+        file_id      bigint      NOT NULL,
+        status       text        NOT NULL,
+        error_reason text,
+        changed_at   timestamptz NOT NULL
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS file_status_journal_file_id_idx ON ops.file_status_journal (file_id);",
+    "ALTER TABLE ops.file_registry ADD COLUMN IF NOT EXISTS attempt_count integer NOT NULL DEFAULT 0;",
+    "ALTER TABLE ops.file_registry ADD COLUMN IF NOT EXISTS next_attempt_at timestamptz;",
+    "ALTER TABLE ops.file_registry ADD COLUMN IF NOT EXISTS claimed_by text;",
+    "ALTER TABLE ops.file_registry ADD COLUMN IF NOT EXISTS lease_until timestamptz;",
+    "DROP INDEX IF EXISTS ops.file_registry_queue_idx;",  # заменен индексом под курсор (keyset) захвата
+    """
+    CREATE INDEX IF NOT EXISTS file_registry_queue_keyset_idx
+    ON ops.file_registry ((COALESCE(uploaded_at, 'infinity'::timestamptz)), id)
+    WHERE status IN ('NEW','PROCESSING','ERROR');
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS file_registry_no_script_idx ON ops.file_registry (id)
+    WHERE error_reason = 'NO_SCRIPT_FOUND';
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION ops.notify_file_registry() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM pg_notify('{NOTIFY_CHANNEL}', NEW.id::text);
+        RETURN NEW;
+    END
+    $$;
+    """,
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'file_registry_notify') THEN
+            CREATE TRIGGER file_registry_notify
+            AFTER INSERT OR UPDATE OF status ON ops.file_registry
+            FOR EACH ROW WHEN (NEW.status = 'NEW')
+            EXECUTE FUNCTION ops.notify_file_registry();
+        END IF;
+    END
+    $$;
+    """,
+]
+
+TASK_METRICS_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS ops.task_metrics (
+        metric_id   bigserial PRIMARY KEY,
+        task_id     bigint,
+        node        text,
+        source      text NOT NULL,
+        client      text,
+        phase       text NOT NULL,
+        started_at  timestamptz NOT NULL,
+        duration_ms double precision NOT NULL,
+        rows        bigint,
+        bytes       bigint,
+        error       text
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS task_metrics_client_phase_idx ON ops.task_metrics (client, phase, started_at);",
+]
 
 # === СТОЛБЦЫ CSV (для просмотра) ===
 COLUMNS = [
@@ -82,11 +266,20 @@ COLUMNS = [
     "report_type",
     "uploaded_at",
     "created_at",
+    "attempt_count",
     "script",
 ]
 
 # ========== УТИЛИТЫ ==========
 
+_print_lock = threading.Lock()
+_db_lock = threading.Lock()          # одно соединение на все потоки: запросы+commit не должны перемешиваться
+
+def log(*args) -> None:
+    """print, не перемешивающий строки параллельных задач."""
+    with _print_lock:
+        print(*args, flush=True)
+
 def ensure_dir(path: str) -> None:
     if not os.path.isdir(path):
         os.makedirs(path, exist_ok=True)
@@ -97,28 +290,110 @@ def get_csv_path() -> str:
 def get_tmp_path() -> str:
     return os.path.join(REESTR_DIR, TMP_NAME)
 
-def get_script_path(data_provider: str, client_name: str) -> str:
-    """Определяем путь к клиентскому скрипту."""
+def get_client_folder(data_provider: str, client_name: str) -> str | None:
     if data_provider == "Дистрибьютор":
         base_folder = os.path.join(SCRIPTS_BASE, "Distibutors")  # оставлено как есть
     elif data_provider == "Сеть":
         base_folder = os.path.join(SCRIPTS_BASE, "Nets")
     else:
-        return "NO_SCRIPT_FOUND"
+        return None
+    return os.path.join(base_folder, str(client_name))
+
+def get_spec_path(data_provider: str, client_name: str) -> str | None:
+    """Спецификация клиента для общего движка ({Client}_spec.json), если есть."""
+    client_folder = get_client_folder(data_provider, client_name)
+    if client_folder is None:
+        return None
+    spec_file = os.path.join(client_folder, f"{client_name}_spec.json")
+    return spec_file if os.path.isfile(spec_file) else None
 
-    client_folder = os.path.join(base_folder, client_name)
+def get_script_path(data_provider: str, client_name: str) -> str:
+    """
+    Определяем путь к клиентскому скрипту: свой {Client}_processing.py, иначе — общий SPEC_RUNNER,
+    если у клиента есть спецификация.
+    """
+    client_folder = get_client_folder(data_provider, client_name)
+    if client_folder is None:
+        return "NO_SCRIPT_FOUND"
     script_file = os.path.join(client_folder, f"{client_name}_processing.py")
-    return script_file if os.path.isfile(script_file) else "NO_SCRIPT_FOUND"
+    if os.path.isfile(script_file):
+        return script_file
+    if get_spec_path(data_provider, client_name):
+        return SPEC_RUNNER
+    return "NO_SCRIPT_FOUND"
 
-def sha256sum(p: Path, chunk: int = 2**20) -> str:
-    h = hashlib.sha256()
-    with open(p, "rb") as f:
-        while True:
-            b = f.read(chunk)
-            if not b:
-                break
-            h.update(b)
-    return h.hexdigest()
+def _declares_batch(tree: ast.Module) -> bool:
+    """В модуле есть присваивание SUPPORTS_BATCH = True верхнего уровня (последнее присваивание побеждает)."""
+    found = False
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            targets, value = node.targets, node.value
+        elif isinstance(node, ast.AnnAssign) and node.value is not None:
+            targets, value = [node.target], node.value
+        else:
+            continue
+        if any(isinstance(t, ast.Name) and t.id == "SUPPORTS_BATCH" for t in targets):
+            found = isinstance(value, ast.Constant) and value.value is True
+    return found
+
+class ScriptResolver:
+    """
+    Скрипт и спецификация клиента на один проход очереди: (data_provider, client_name) -> (скрипт, спецификация).
+    Файловая система опрашивается один раз на клиента, а не на каждую строку; список файлов общего движка
+    (часть ключа кэша результатов) — один раз за проход. clear() — в начале каждого прохода (run_cycle).
+    """
+
+    def __init__(self):
+        self._paths: dict[tuple, tuple[str, str | None]] = {}
+        self._engine: tuple[str, ...] | None = None
+        self._batch: dict[str, bool] = {}
+        self._lock = threading.Lock()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._paths.clear()
+            self._engine = None
+            self._batch.clear()
+
+    def paths(self, data_provider: str, client_name: str) -> tuple[str, str | None]:
+        key = (data_provider, client_name)
+        with self._lock:
+            cached = self._paths.get(key)
+        if cached is None:
+            cached = (get_script_path(data_provider, client_name), get_spec_path(data_provider, client_name))
+            with self._lock:
+                self._paths[key] = cached
+        return cached
+
+    def script(self, data_provider: str, client_name: str) -> str:
+        return self.paths(data_provider, client_name)[0]
+
+    def spec(self, data_provider: str, client_name: str) -> str | None:
+        return self.paths(data_provider, client_name)[1]
+
+    def supports_batch(self, script: str) -> bool:
+        """Скрипт явно объявил пакетный контракт: SUPPORTS_BATCH = True на верхнем уровне модуля
+        (common/spec_runner.py или свой скрипт). Упоминание TASK_IDS в тексте — не признак."""
+        with self._lock:
+            cached = self._batch.get(script)
+        if cached is None:
+            try:
+                with open(script, "rb") as f:
+                    cached = _declares_batch(ast.parse(f.read(), filename=script))
+            except (OSError, SyntaxError, ValueError):
+                cached = False
+            with self._lock:
+                self._batch[script] = cached
+        return cached
+
+    def engine_paths(self) -> tuple[str, ...]:
+        with self._lock:
+            if self._engine is None:
+                self._engine = tuple(sorted(os.path.join(COMMON_DIR, n) for n in os.listdir(COMMON_DIR)
+                                            if n.endswith(".py")))
+            return self._engine
+
+_scripts = ScriptResolver()
 
 def safe_remove(p: Path) -> None:
     try:
@@ -131,69 +406,395 @@ def safe_remove(p: Path) -> None:
 def db_connect():
     return psycopg2.connect(**DB)
 
-def db_try_advisory_lock(conn) -> bool:
-    with conn.cursor() as cur:
-        cur.execute("SELECT pg_try_advisory_lock(%s);", (ADVISORY_KEY,))
-        locked, = cur.fetchone()
-        return bool(locked)
-
-def db_advisory_unlock(conn) -> None:
-    with conn.cursor() as cur:
-        cur.execute("SELECT pg_advisory_unlock(%s);", (ADVISORY_KEY,))
-
-def db_update_status(conn, _id: int, status: str, error_reason: str | None = None) -> None:
-    if status not in ALLOWED_STATUSES:
-        raise ValueError(f"Недопустимый статус: {status}")
-    with conn.cursor() as cur:
-        cur.execute(
-            "UPDATE ops.file_registry SET status = %s, error_reason = %s WHERE id = %s;",
-            (status, error_reason, _id),
+def db_ensure_schema(conn) -> None:
+    """Служебные колонки/таблицы оркестратора (идемпотентно)."""
+    with _db_lock:
+        with conn.cursor() as cur:
+            for ddl in SCHEMA_DDL + (TASK_METRICS_DDL if TRACE_TO_DB else []):
+                cur.execute(ddl)
+        conn.commit()
+
+class StatusWriter:
+    """
+    Журнал переходов статусов ops.file_registry.
+
+    Переходы копятся в буфере и пишутся пачкой одной транзакцией: UPDATE ... FROM (VALUES ...)
+    по последнему переходу каждого id + все переходы в ops.file_status_journal.
+    Сброс — при STATUS_FLUSH_SIZE записях, если старейшая ждет дольше STATUS_FLUSH_SEC (проверяет и фоновый
+    поток start(): переход не ждет следующего set()), при durable=True (PROCESSING перед запуском скрипта)
+    и в flush() в конце запуска.
+    release=True (финальный переход) снимает аренду строки и выставляет next_attempt_at
+    (None — попытка не нужна); attempts — новое значение attempt_count (None — не меняем).
+    Строку, которую уже перехватил другой узел, не трогаем, и в журнал такой переход не попадает.
+    on_release(id) вызывается после commit финального перехода: до тех пор heartbeat держит аренду
+    (строка в буфере все еще PROCESSING в БД — ее не должен забрать другой узел).
+    set_in_transaction() пишет финальный переход в транзакции вызывающего (загрузка COPY), мимо буфера.
+    """
+
+    UPDATE_SQL = """
+        UPDATE ops.file_registry AS r
+        SET status = v.status, error_reason = v.error_reason, status_changed_at = v.changed_at,
+            claimed_by      = CASE WHEN v.release THEN NULL ELSE r.claimed_by END,
+            lease_until     = CASE WHEN v.release THEN NULL ELSE r.lease_until END,
+            next_attempt_at = CASE WHEN v.release THEN v.next_attempt_at ELSE r.next_attempt_at END,
+            attempt_count   = COALESCE(v.attempts, r.attempt_count)
+        FROM (VALUES %s) AS v(id, status, error_reason, changed_at, release, attempts, next_attempt_at, node)
+        WHERE r.id = v.id AND (r.claimed_by IS NULL OR r.claimed_by = v.node)
+        RETURNING r.id;
+    """
+    UPDATE_TEMPLATE = ("(%s::bigint, %s::text, %s::text, %s::timestamptz, %s::boolean,"
+                       " %s::integer, %s::timestamptz, %s::text)")
+    JOURNAL_SQL = "INSERT INTO ops.file_status_journal (file_id, status, error_reason, changed_at) VALUES %s;"
+    JOURNAL_TEMPLATE = "(%s::bigint, %s::text, %s::text, %s::timestamptz)"
+
+    def __init__(self, conn, node_id: str = NODE_ID,
+                 flush_size: int = STATUS_FLUSH_SIZE, flush_sec: float = STATUS_FLUSH_SEC, on_release=None):
+        self.conn = conn
+        self.node_id = node_id
+        self.on_release = on_release
+        self.flush_size = flush_size
+        self.flush_sec = flush_sec
+        self._buf: list[tuple] = []
+        self._oldest: float | None = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._age_flush, name="status-flush", daemon=True)
+        self._thread.start()
+
+    def _age_flush(self) -> None:
+        """Фоном: сброс буфера, как только старейший переход ждет дольше flush_sec (задачи могут идти часами)."""
+        while not self._stop.wait(min(1.0, self.flush_sec)):
+            with self._lock:
+                if self._oldest is None or time.monotonic() - self._oldest < self.flush_sec:
+                    continue
+                try:
+                    self._flush_locked()
+                except Exception as e:
+                    self._oldest = time.monotonic()  # следующая попытка — через flush_sec
+                    log(f"[WARN] Статусы не записаны ({len(self._buf)} переходов), повтор позже: {e}")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def set(self, _id: int, status: str, error_reason: str | None = None,
+            durable: bool = False, release: bool = True,
+            attempts: int | None = None, next_attempt_at: datetime | None = None) -> None:
+        if status not in ALLOWED_STATUSES:
+            raise ValueError(f"Недопустимый статус: {status}")
+        with self._lock:
+            self._buf.append((_id, status, error_reason, datetime.now().astimezone(), release,
+                              attempts, next_attempt_at))
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if (durable or len(self._buf) >= self.flush_size
+                    or time.monotonic() - self._oldest >= self.flush_sec):
+                self._flush_locked()
+
+    def set_in_transaction(self, cur, _id: int, status: str, error_reason: str | None = None) -> None:
+        """Финальный переход на курсоре чужой транзакции; фиксируется ее commit'ом (или откатывается с ней)."""
+        if status not in ALLOWED_STATUSES:
+            raise ValueError(f"Недопустимый статус: {status}")
+        self._write(cur, [(_id, status, error_reason, datetime.now().astimezone(), True, None, None)])
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def pending(self) -> "set[int]":  # в теле класса имя set — метод
+        """id, чей финальный переход еще в буфере (не записан в БД)."""
+        with self._lock:
+            return {tr[0] for tr in self._buf if tr[4]}
+
+    def _write(self, cur, transitions: list[tuple]) -> "set[int]":
+        """UPDATE по последнему переходу каждого id; в журнал — переходы только тех id, что реально обновлены."""
+        latest = {}
+        for tr in transitions:
+            latest[tr[0]] = tr + (self.node_id,)
+        updated = {row[0] for row in execute_values(cur, self.UPDATE_SQL, list(latest.values()),
+                                                    template=self.UPDATE_TEMPLATE, fetch=True)}
+        journal = [tr[:4] for tr in transitions if tr[0] in updated]
+        if journal:
+            execute_values(cur, self.JOURNAL_SQL, journal, template=self.JOURNAL_TEMPLATE)
+        lost = sorted(latest.keys() - updated)
+        if lost:
+            log(f"[WARN] Аренда перехвачена другим узлом, статус не записан: id={lost}")
+        return updated
+
+    def _flush_locked(self) -> None:
+        if not self._buf:
+            return
+        with _db_lock:
+            try:
+                with self.conn.cursor() as cur:
+                    self._write(cur, self._buf)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        released = [tr[0] for tr in self._buf if tr[4]]
+        self._buf = []
+        self._oldest = None
+        if self.on_release is not None:
+            for _id in released:
+                self.on_release(_id)
+
+class MetricsWriter:
+    """Span'ы трассировки -> ops.task_metrics пачками. Ошибка записи метрик не мешает обработке."""
+
+    INSERT_SQL = """
+        INSERT INTO ops.task_metrics
+            (task_id, node, source, client, phase, started_at, duration_ms, rows, bytes, error)
+        VALUES %s;
+    """
+
+    def __init__(self, conn, node_id: str = NODE_ID, flush_size: int = STATUS_FLUSH_SIZE):
+        self.conn = conn
+        self.node_id = node_id
+        self.flush_size = flush_size
+        self._buf: list[tuple] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: dict) -> None:
+        task_id = span.get("task_id")
+        with self._lock:
+            self._buf.append((
+                task_id if isinstance(task_id, int) else None,
+                span.get("node") or self.node_id,
+                span.get("source"),
+                span.get("client"),
+                span.get("phase"),
+                span.get("ts"),
+                span.get("dur_ms"),
+                span.get("rows"),
+                span.get("bytes"),
+                span.get("error"),
+            ))
+            if len(self._buf) >= self.flush_size:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if not self._buf:
+            return
+        rows, self._buf = self._buf, []
+        with _db_lock:
+            try:
+                with self.conn.cursor() as cur:
+                    execute_values(cur, self.INSERT_SQL, rows)
+                self.conn.commit()
+            except psycopg2.Error as e:
+                self.conn.rollback()
+                log(f"[WARN] Метрики не записаны ({len(rows)} span'ов): {e}")
+
+class LeaseKeeper:
+    """
+    Аренды строк ops.file_registry, взятых этим узлом.
+
+    claim() захватывает пачку свободных строк (SELECT ... FOR UPDATE SKIP LOCKED): строка свободна,
+    если у нее нет аренды или аренда истекла (узел упал). Пачки идут по курсору (uploaded_at, id) — keyset:
+    каждая следующая начинается после последней строки предыдущей, по индексу, без списка уже взятых id. Пока строка не завершена (done), фоновый
+    heartbeat продлевает ее аренду; stop() отпускает аренды незавершенных строк.
+    """
+
+    CLAIM_SQL = """
+        WITH picked AS (
+            SELECT id
+            FROM ops.file_registry
+            WHERE status IN ('NEW','PROCESSING','ERROR')
+              AND (lease_until IS NULL OR lease_until < now())
+              AND (next_attempt_at IS NULL OR next_attempt_at <= now())
+              AND (%(after_id)s::bigint IS NULL
+                   OR (COALESCE(uploaded_at, 'infinity'::timestamptz), id)
+                      > (%(after_ts)s::timestamptz, %(after_id)s::bigint))
+              AND (%(only)s::bigint[] IS NULL OR id = ANY(%(only)s::bigint[]))
+            ORDER BY COALESCE(uploaded_at, 'infinity'::timestamptz), id
+            LIMIT %(limit)s
+            FOR UPDATE SKIP LOCKED
         )
-    conn.commit()
-
-def fetch_registry_rows(conn):
-    """Берем из БД NEW/PROCESSING/ERROR для обработки."""
-    sql = """
-        SELECT
-            id,
-            file_path,
-            status,
-            data_provider,
-            report_year,
-            report_month,
-            client_name,
-            report_type,
-            uploaded_at,
-            created_at
-        FROM ops.file_registry
-        WHERE status IN ('NEW','PROCESSING','ERROR')
-        ORDER BY uploaded_at;
-    """
-    with conn.cursor() as cur:
-        cur.execute(sql)
-        rows = cur.fetchall()
-
-    result = []
-    for row in rows:
-        row = list(row)
-        data_provider = row[3]
-        client_name = row[6]
-        script_path = get_script_path(data_provider, client_name)
-        row.append(script_path)
-        result.append(row)
-    return result
-
-def write_csv_atomic(rows) -> str:
-    ensure_dir(REESTR_DIR)
-    out_path = get_csv_path()
-    tmp_path = get_tmp_path()
-    with open(tmp_path, "w", newline="", encoding="utf-8-sig") as f:
-        w = csv.writer(f, delimiter=";")
-        w.writerow(COLUMNS)
-        for r in rows:
-            w.writerow(r)
-    os.replace(tmp_path, out_path)
-    return out_path
+        UPDATE ops.file_registry AS r
+        SET claimed_by = %(node)s, lease_until = now() + make_interval(secs => %(lease)s)
+        FROM picked
+        WHERE r.id = picked.id
+        RETURNING
+            r.id,
+            r.file_path,
+            r.status,
+            r.data_provider,
+            r.report_year,
+            r.report_month,
+            r.client_name,
+            r.report_type,
+            r.uploaded_at,
+            r.created_at,
+            r.attempt_count;
+    """
+    EXTEND_SQL = """
+        UPDATE ops.file_registry
+        SET lease_until = now() + make_interval(secs => %(lease)s)
+        WHERE claimed_by = %(node)s AND id = ANY(%(ids)s);
+    """
+    RELEASE_SQL = """
+        UPDATE ops.file_registry
+        SET claimed_by = NULL, lease_until = NULL
+        WHERE claimed_by = %(node)s AND id = ANY(%(ids)s);
+    """
+
+    def __init__(self, conn, node_id: str = NODE_ID, lease_sec: int = LEASE_SEC,
+                 heartbeat_sec: int = LEASE_HEARTBEAT_SEC):
+        self.conn = conn
+        self.node_id = node_id
+        self.lease_sec = lease_sec
+        self.heartbeat_sec = heartbeat_sec
+        self._active: set[int] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _execute(self, sql: str, params: dict) -> list:
+        with _db_lock:
+            try:
+                with self.conn.cursor() as cur:
+                    cur.execute(sql, params)
+                    rows = cur.fetchall() if cur.description else []
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        return rows
+
+    def claim(self, limit: int, after: tuple | None = None, only: list[int] | None = None) -> list[list]:
+        """
+        Захват до limit строк в порядке (uploaded_at, id), строго после курсора after (см. claim_cursor);
+        если задан only — только из него. К строке добавляется путь скрипта (ScriptResolver прохода).
+        """
+        after_ts, after_id = after if after else (None, None)
+        rows = self._execute(self.CLAIM_SQL, dict(after_ts=after_ts, after_id=after_id, only=only, limit=limit,
+                                                  node=self.node_id, lease=self.lease_sec))
+        rows.sort(key=lambda row: (row[8] is None, row[8] or 0, row[0]))
+        result = []
+        for row in rows:
+            row = list(row)
+            data_provider = row[3]
+            client_name = row[6]
+            script_path = _scripts.script(data_provider, client_name)
+            row.append(script_path)
+            result.append(row)
+        with self._lock:
+            self._active.update(r[0] for r in result)
+        return result
+
+    def done(self, _id: int) -> None:
+        """Строка завершена: аренду снимет ее финальный статус, heartbeat больше не нужен."""
+        with self._lock:
+            self._active.discard(_id)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._heartbeat, name="lease-heartbeat", daemon=True)
+        self._thread.start()
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(self.heartbeat_sec):
+            with self._lock:
+                ids = list(self._active)
+            if not ids:
+                continue
+            try:
+                self._execute(self.EXTEND_SQL, dict(lease=self.lease_sec, node=self.node_id, ids=ids))
+            except Exception as e:
+                log(f"[WARN] Не удалось продлить аренды ({len(ids)} строк): {e}")
+
+    def release(self, ids: list[int]) -> None:
+        """Отпустить аренды строк, которые так и не ушли в работу (проход прерван, выход)."""
+        with self._lock:
+            self._active.difference_update(ids)
+        if ids:
+            try:
+                self._execute(self.RELEASE_SQL, dict(node=self.node_id, ids=ids))
+            except psycopg2.Error as e:
+                log(f"[WARN] Не удалось снять аренды ({len(ids)} строк), истекут сами: {e}")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.heartbeat_sec)
+        with self._lock:
+            ids = list(self._active)
+        self.release(ids)
+
+def claim_cursor(row) -> tuple:
+    """Позиция строки в очереди для keyset-захвата: строки без uploaded_at — в конце (как в ORDER BY)."""
+    return (row[8] if row[8] is not None else "infinity", row[0])
+
+def claimed_batches(leases: LeaseKeeper, snapshot: "RegistrySnapshot", batch_size: int = CLAIM_BATCH,
+                    only: list[int] | None = None):
+    """
+    Пачки захваченных строк по курсору: строки, уже пройденные в этом запуске, повторно не берем
+    (пропущенные — чужая аренда, срок попытки не наступил — достанутся следующему проходу).
+    Первая пачка уходит в работу сразу, следующие захватываются по мере освобождения пула.
+    """
+    after = None
+    while True:
+        with _tracer.span("claim") as m:
+            rows = leases.claim(batch_size, after, only)
+            m["rows"] = len(rows)
+        if not rows:
+            return
+        after = claim_cursor(rows[-1])
+        snapshot.add(rows)
+        yield rows
+
+def notified_rows(listen_conn, leases: LeaseKeeper, snapshot: "RegistrySnapshot"):
+    """
+    Опрос уведомлений во время прохода (демон): пришедшие id захватываются сразу и идут в свободные потоки пула,
+    не дожидаясь конца прохода (длинных скриптов). Возвращает функцию без аргументов -> захваченные строки.
+    """
+    def poll() -> list:
+        ids = _drain_notifications(listen_conn)
+        if not ids:
+            return []
+        with _tracer.span("claim") as m:
+            rows = leases.claim(len(ids), only=ids)
+            m["rows"] = len(rows)
+        if rows:
+            log(f"[STEP] Уведомление во время прохода: новых строк {len(rows)}")
+            snapshot.add(rows)
+        return rows
+    return poll
+
+def task_payload(r) -> str:
+    """Строка реестра для клиентского скрипта (JSON в TASK_PAYLOAD) — скрипт не перечитывает CSV."""
+    return json.dumps(dict(zip(COLUMNS, r)), ensure_ascii=False, default=str)
+
+class RegistrySnapshot:
+    """CSV-снимок строк, взятых запуском (read-only, для просмотра): дописывается по мере захвата, публикуется атомарно."""
+
+    def __init__(self):
+        ensure_dir(REESTR_DIR)
+        self.count = 0
+        self._f = open(get_tmp_path(), "w", newline="", encoding="utf-8-sig")
+        self._w = csv.writer(self._f, delimiter=";")
+        self._w.writerow(COLUMNS)
+
+    def add(self, rows) -> None:
+        self._w.writerows(rows)
+        self._f.flush()
+        self.count += len(rows)
+
+    def close(self) -> str:
+        self._f.close()
+        if not self.count:
+            return write_empty_marker()
+        out_path = get_csv_path()
+        os.replace(get_tmp_path(), out_path)
+        return out_path
 
 def write_empty_marker() -> str:
     ensure_dir(REESTR_DIR)
@@ -202,196 +803,856 @@ def write_empty_marker() -> str:
     with open(tmp_path, "w", newline="", encoding="utf-8-sig") as f:
         w = csv.writer(f, delimiter=";")
         w.writerow(COLUMNS)
-        w.writerow(["", "", "NO_TASKS", "", "", "", "", "", datetime.now().isoformat(sep=" "), "", ""])
+        w.writerow(["", "", "NO_TASKS", "", "", "", "", "", datetime.now().isoformat(sep=" "), "", "", ""])
     os.replace(tmp_path, out_path)
     return out_path
 
 # ========== РАБОТА С ФАЙЛАМИ ==========
 
-def cleanup_final_dir(strategy: str = CLEANUP_STRATEGY, older_than_min: int = CLEANUP_OLDER_THAN_MIN) -> None:
-    """Осторожная очистка итоговой папки."""
+def cleanup_final_dir(started_ts: float, strategy: str = CLEANUP_STRATEGY,
+                      older_than_min: int = CLEANUP_OLDER_THAN_MIN, max_files: int = CLEANUP_MAX_FILES,
+                      max_sec: float = CLEANUP_MAX_SEC) -> tuple[int, bool]:
+    """
+    Осторожная очистка итоговой папки в пределах бюджета -> (удалено файлов, папка пройдена целиком).
+    Идет параллельно с задачами, поэтому файлы не моложе started_ts (результаты текущего прохода)
+    не трогаем ни в одной стратегии.
+    """
     Path(FINAL_DIR).mkdir(parents=True, exist_ok=True)
-    if strategy == "all":
-        for p in Path(FINAL_DIR).iterdir():
-            if p.is_file():
-                safe_remove(p)
-        return
-
-    cutoff = time.time() - older_than_min * 60
-    for p in Path(FINAL_DIR).iterdir():
-        if p.is_file():
+    cutoff = started_ts if strategy == "all" else min(started_ts, time.time() - older_than_min * 60)
+    deadline = time.monotonic() + max_sec
+    removed = 0
+    with os.scandir(FINAL_DIR) as it:
+        for entry in it:
+            if removed >= max_files or time.monotonic() > deadline:
+                return removed, False
             try:
-                if p.stat().st_mtime < cutoff:
-                    safe_remove(p)
-            except Exception:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    safe_remove(Path(entry.path))
+                    removed += 1
+            except OSError:
                 pass
+    return removed, True
 
-def files_for_id(dir_path: str, _id: int, since_ts: float | None) -> list[Path]:
-    """Ищем файлы для конкретного id. Если since_ts задан — фильтруем по времени."""
-    root = Path(dir_path)
-    if not root.is_dir():
-        return []
-    pat = re.compile(rf'[_\-]id{_id}(?:[_\.\-]|$)', re.IGNORECASE)
-    out: list[Path] = []
-    for name in os.listdir(dir_path):
-        p = root / name
-        if not p.is_file():
-            continue
-        try:
-            if since_ts is None or p.stat().st_mtime >= since_ts:
-                if pat.search(name):
-                    out.append(p)
-        except OSError:
-            continue
-    return out
+def _housekeeping(started_ts: float) -> None:
+    try:
+        removed, complete = cleanup_final_dir(started_ts)
+        log(f"[STEP] Очистка '{FINAL_DIR}' (strategy={CLEANUP_STRATEGY}): удалено {removed}"
+            + ("" if complete else " — бюджет исчерпан, остаток в следующем проходе"))
+    except OSError as e:
+        log(f"[WARN] Очистка '{FINAL_DIR}' не выполнена: {e}")
+    evict_result_cache()
 
-def move_with_retries(src: Path, load_dir: Path, max_retries: int = MOVE_MAX_RETRIES, sleep_sec: int = MOVE_RETRY_SLEEP) -> tuple[bool, str, Path | None]:
-    """Перенос файла в LOAD_DIR с ретраями и защитой от коллизий."""
-    load_dir.mkdir(parents=True, exist_ok=True)
-    dst = load_dir / src.name
+def start_housekeeping(started_ts: float) -> threading.Thread:
+    """Очистка FINAL_DIR и вытеснение кэша — фоном, задачи стартуют сразу."""
+    t = threading.Thread(target=_housekeeping, args=(started_ts,), name="housekeeping", daemon=True)
+    t.start()
+    return t
 
-    if dst.exists():
-        try:
-            if dst.stat().st_size == src.stat().st_size and sha256sum(dst) == sha256sum(src):
-                return True, "ALREADY_PRESENT", dst
-        except Exception:
-            pass
-        root, ext = os.path.splitext(src.name)
-        dst = load_dir / f"{root}_{int(time.time())}{ext}"
+class OutputIndex:
+    """
+    Индекс каталога результатов: id -> [(путь, mtime)].
+    Строится одним проходом os.scandir и перестраивается, только если изменилось mtime каталога
+    (файл добавлен/удален/переименован). Нужен для скриптов, не оставивших манифест.
+    """
+
+    ID_RE = re.compile(r'[_\-]id(\d+)(?=[_\.\-]|$)', re.IGNORECASE)
+
+    def __init__(self, dir_path: str):
+        self.dir_path = dir_path
+        self._dir_mtime: int | None = None
+        self._by_id: dict[int, list[tuple[str, float]]] = {}
+        self._lock = threading.Lock()
+
+    def files_for_id(self, _id: int, since_ts: float | None) -> list[Path]:
+        """Файлы для id; если since_ts задан — только не старше него."""
+        with self._lock:
+            try:
+                dir_mtime = os.stat(self.dir_path).st_mtime_ns
+            except OSError:
+                return []
+            if dir_mtime != self._dir_mtime:
+                self._rebuild()
+                self._dir_mtime = dir_mtime
+            entries = list(self._by_id.get(_id, ()))
+        return [Path(p) for p, mtime in entries if since_ts is None or mtime >= since_ts]
 
-    for _ in range(max_retries):
+    def _rebuild(self) -> None:
+        by_id: dict[int, list[tuple[str, float]]] = {}
+        with os.scandir(self.dir_path) as it:
+            for entry in it:
+                if not entry.name.lower().endswith(OUTPUT_EXTENSIONS):
+                    continue
+                ids = {int(m.group(1)) for m in self.ID_RE.finditer(entry.name)}
+                if not ids:
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    mtime = entry.stat().st_mtime
+                except OSError:
+                    continue
+                for _id in ids:
+                    by_id.setdefault(_id, []).append((entry.path, mtime))
+        self._by_id = by_id
+
+_output_index = OutputIndex(FINAL_DIR)
+
+def manifest_path(_id: int) -> str:
+    return os.path.join(MANIFEST_DIR, f"id{_id}.json")
+
+def batch_manifest_path(ids: list[int]) -> str:
+    return os.path.join(MANIFEST_DIR, f"batch_id{ids[0]}_{len(ids)}.json")
+
+def task_trace_path(_id: int) -> str | None:
+    return os.path.join(TRACE_DIR, "tasks", f"id{_id}.jsonl") if TRACE_DIR else None
+
+def collect_task_trace(path: str | None) -> None:
+    """Span'ы, которые записал скрипт задачи, — в общий трейс (и ops.task_metrics)."""
+    if not path:
+        return
+    for span in read_spans(path):
+        span.setdefault("node", NODE_ID)
+        _tracer.write(span)
+    safe_remove(Path(path))
+
+def read_manifest(path: str) -> list[Path] | None:
+    """Пути результатов из манифеста скрипта; None — манифеста нет (или он битый)."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return [Path(p) for p in data.get("outputs", []) if os.path.isfile(p)]
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, AttributeError) as e:
+        log(f"   WARN: не смог прочитать манифест {path}: {e}")
+        return None
+
+def read_batch_manifest(path: str) -> dict[int, dict]:
+    """Итоги пакетного запуска по id ({"results": {"<id>": {"outputs": [...], "error": ...}}}); нет файла — пусто."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return {int(k): v for k, v in data.get("results", {}).items() if isinstance(v, dict)}
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, AttributeError) as e:
+        log(f"   WARN: не смог прочитать манифест {path}: {e}")
+        return {}
+
+# ========== ЗАПУСК СКРИПТОВ ==========
+
+_warm_pool: WarmWorkerPool | None = None   # создается в run_pipeline при EXEC_MODE="warm"
+_mover: BackgroundMover | None = None      # фоновый перенос FINAL_DIR -> LOAD_DIR, создается в _start_session
+_loader: BulkLoader | None = None          # COPY в STAGING_TABLE при LOAD_MODE="copy", создается в _start_session
+_tracer = Tracer(None)                     # трассировка фаз; настраивается в _start_session
+_metrics: MetricsWriter | None = None      # при TRACE_TO_DB
+_result_cache = ResultCache(CACHE_DIR, HEADER_PATH, CACHE_MAX_AGE_DAYS, CACHE_MAX_MB) if CACHE_ENABLED else None
+
+def client_code_paths(spec_path: str | None) -> tuple[str, ...]:
+    """Файлы, от которых кроме самого скрипта зависит результат: спецификация и общий движок."""
+    return ((spec_path,) if spec_path else ()) + _scripts.engine_paths()
+
+def cache_fields(r) -> dict:
+    """Поля строки реестра в ключе кэша: путь (filename_ish в результате), клиент, провайдер, тип отчета —
+    по ним скрипт выбирает строку и заполняет столбцы, так что другая регистрация того же файла — другой результат."""
+    return {"file_path": r[1], "data_provider": r[3], "client_name": r[6], "report_type": r[7]}
+
+def task_output_format() -> str:
+    """Формат результата для скрипта: при загрузке через COPY — всегда CSV."""
+    return "csv" if LOAD_MODE == "copy" else OUTPUT_FORMAT
+
+def task_log_path(_id: int) -> str | None:
+    if not TASK_LOG_DIR:
+        return None
+    return os.path.join(TASK_LOG_DIR, f"id{_id}_{datetime.now():%Y%m%d_%H%M%S}.log")
+
+def execute_script(script: str, task_env: dict, log_path: str | None = None,
+                   timeout: float | None = None) -> tuple[int, str, str]:
+    """
+    Выполняет клиентский скрипт для задачи (или пакета) -> (returncode, хвост stdout, хвост stderr).
+    В режиме "warm" — main() в тёплом воркере; если воркер недоступен или у скрипта нет main(),
+    запускаем отдельный интерпретатор. Вывод читается потоково: в памяти только OUTPUT_TAIL_CHARS
+    последних символов, полный лог — в log_path. При таймауте (по умолчанию SCRIPT_TIMEOUT_SEC) —
+    subprocess.TimeoutExpired.
+    """
+    timeout = timeout or SCRIPT_TIMEOUT_SEC
+    if _warm_pool is not None:
         try:
-            shutil.move(str(src), str(dst))
-            return True, "OK", dst
-        except PermissionError:
-            time.sleep(sleep_sec)
-        except OSError as e:
-            winerr = getattr(e, "winerror", None)
-            if winerr in (5, 32, 33):  # access denied / sharing violation
-                time.sleep(sleep_sec)
-                continue
-            if winerr == 206:          # path too long
-                return False, "PATH_TOO_LONG", None
-            if e.errno in (28,):       # no space
-                return False, "NO_SPACE", None
-            return False, f"OSERROR:{e.errno or winerr}", None
-    return False, "LOCKED", None
+            returncode, stdout, stderr = _warm_pool.run(script, task_env, timeout, log_path)
+        except subprocess.TimeoutExpired:
+            raise
+        except Exception as e:
+            log(f"   WARN: тёплый воркер недоступен ({e}) -> отдельный процесс")
+        else:
+            if returncode is not None:
+                return returncode, stdout, stderr
+
+    env = os.environ.copy()
+    env.update(task_env)
+    return run_streaming([PYTHON_EXE, script], env, timeout, OUTPUT_TAIL_CHARS, log_path)
 
 # ========== ОСНОВНАЯ ЛОГИКА ==========
 
-def run_pipeline():
-    run_start_ts = time.time()
-    ensure_dir(REESTR_DIR)
-    ensure_dir(FINAL_DIR)
-    ensure_dir(LOAD_DIR)
+def prepare_task(status_writer: StatusWriter, leases: LeaseKeeper, r) -> tuple[str | None, str | None] | None:
+    """
+    Проверки до запуска: нет скрипта -> NO_SCRIPT_FOUND; вход, скрипт, шапка и поля регистрации не менялись ->
+    результат или ошибка из кэша. Такие строки завершаются сразу (None); иначе -> (путь спецификации, ключ кэша) для запуска.
+    """
+    (_id, file_path, status, data_provider, report_year, report_month,
+     client_name, report_type, uploaded_at, created_at, attempt_count, script) = r
 
-    with db_connect() as conn:
-        if not db_try_advisory_lock(conn):
-            print("[WARN] Оркестратор уже запущен - выходим.")
-            return
-        try:
-            print(f"[STEP] Очистка '{FINAL_DIR}' (strategy={CLEANUP_STRATEGY})...")
-            cleanup_final_dir()
+    if not script or script == "NO_SCRIPT_FOUND":  # существование проверено при разрешении (ScriptResolver)
+        log(f" - id={_id} скрипт не найден -> PROCESSING(reason=NO_SCRIPT_FOUND), ждем изменения каталога скриптов")
+        status_writer.set(_id, STAT_PROC, "NO_SCRIPT_FOUND", next_attempt_at=RETRY_NEVER)
+        return None
+
+    # тот же вход + тот же скрипт (спецификация, движок) + та же шапка -> берем прошлый результат без запуска
+    spec_path = _scripts.spec(data_provider, client_name)
+    with _tracer.span("cache_lookup", task_id=_id, client=client_name) as m:
+        cache_key = (_result_cache.key_for(str(file_path or ""), script, client_code_paths(spec_path),
+                                           variant=task_output_format(), fields=cache_fields(r))
+                     if _result_cache else None)
+        cached = _result_cache.lookup(cache_key) if cache_key else None
+        m["hit"] = cached is not None
+    if cached is not None:
+        if cached["status"] == "fail":
+            log(f" - id={_id} кэш: вход не менялся, прошлый запуск -> {cached['reason']}; скрипт не запускаем")
+            fail_task(status_writer, _id, attempt_count, cached["reason"])
+            return None
+        out_files = _result_cache.restore(cached, _id, FINAL_DIR)
+        log(f" - id={_id} кэш: вход не менялся, берем готовый результат (файлов={len(out_files)})")
+        deliver_outputs(status_writer, leases, _id, attempt_count, out_files)
+        return None
+    return spec_path, cache_key
+
+def finish_task(status_writer: StatusWriter, leases: LeaseKeeper, r, cache_key: str | None,
+                reason: str | None = None, out_files: list[Path] | None = None) -> None:
+    """Итог запуска для строки: reason — ошибка (ERROR/FAILED), иначе файлы результата (нет файлов — NO_OUTPUT_FILE)."""
+    _id, attempt_count = r[0], r[10]
+    if reason is None and not out_files:
+        log(f"   WARN: нет файлов для id={_id} в '{FINAL_DIR}'")
+        reason = "NO_OUTPUT_FILE"
+    if reason is not None:
+        fail_task(status_writer, _id, attempt_count, reason)
+        if _result_cache:
+            _result_cache.store_failure(cache_key, _id, reason)  # детерминированные ошибки (см. result_cache.py)
+        return
+    if _result_cache:
+        _result_cache.store_success(cache_key, _id, out_files)
+    deliver_outputs(status_writer, leases, _id, attempt_count, out_files)
+
+def log_output_tails(label: str, stdout: str, stderr: str) -> None:
+    # печатаем хвосты логов даже при returncode==0 (если есть)
+    if stdout:
+        log(f"   {label} STDOUT(last {OUTPUT_TAIL_CHARS}):\n", stdout)
+    if stderr:
+        log(f"   {label} STDERR(last {OUTPUT_TAIL_CHARS}):\n", stderr)
+
+def process_task(status_writer: StatusWriter, leases: LeaseKeeper, r, run_start_ts: float,
+                 prepared: tuple[str | None, str | None] | None = None) -> bool:
+    """
+    Обработка одной строки реестра. Возвращает True, если клиентский скрипт запускался.
+    prepared — результат prepare_task, если проверки уже сделаны (строка из пакета).
+    """
+    prepared = prepared or prepare_task(status_writer, leases, r)
+    if prepared is None:
+        return False
+    spec_path, cache_key = prepared
+    (_id, file_path, status, data_provider, report_year, report_month,
+     client_name, report_type, uploaded_at, created_at, attempt_count, script) = r
+
+    # ставим PROCESSING (сразу в БД, до старта скрипта) и запускаем
+    status_writer.set(_id, STAT_PROC, None, durable=True, release=False)
+    log(f" - id={_id} запускаю: {script}")
+
+    manifest = manifest_path(_id)
+    safe_remove(Path(manifest))  # манифест от прошлой попытки не должен попасть в этот запуск
+    trace_file = task_trace_path(_id)
+    if trace_file:
+        safe_remove(Path(trace_file))
+
+    # Передаем TASK_ID и метаданные в окружение
+    task_env = {
+        "TASK_ID": str(_id),
+        "TASK_CLIENT": str(client_name or ""),
+        "TASK_FILE": str(file_path or ""),
+        "TASK_REPORT_TYPE": str(report_type or ""),
+        "TASK_PAYLOAD": task_payload(r),
+        "TASK_MANIFEST": manifest,
+        "TASK_TRACE": trace_file or "",
+        "TASK_SPEC": spec_path or "",
+        "TASK_OUTPUT_FORMAT": task_output_format(),
+    }
+
+    try:
+        with _tracer.span("script", task_id=_id, client=client_name, mode=EXEC_MODE):
+            returncode, stdout, stderr = execute_script(script, task_env, task_log_path(_id))
+    except subprocess.TimeoutExpired:
+        log(f"   id={_id} TIMEOUT ({script}) > {SCRIPT_TIMEOUT_SEC}s")
+        finish_task(status_writer, leases, r, cache_key, reason="TIMEOUT")
+        return True
+    except Exception as e:
+        log(f"   id={_id} ERROR запуск {script}: {e}")
+        finish_task(status_writer, leases, r, cache_key, reason=f"LAUNCH_ERROR:{e}")
+        return True
+    finally:
+        collect_task_trace(trace_file)
 
-            rows = fetch_registry_rows(conn)
-            if rows:
-                out_csv = write_csv_atomic(rows)
-                print(f"[STEP] Реестр сформирован: {out_csv} | записей: {len(rows)}")
+    log_output_tails(f"id={_id}", stdout, stderr)
+
+    if returncode != 0:
+        log(f"   id={_id} FAIL code={returncode}")
+        finish_task(status_writer, leases, r, cache_key, reason=f"RETURN_CODE_{returncode}")
+        return True
+
+    # результаты берем из манифеста скрипта; без манифеста — из индекса FINAL_DIR
+    # (сперва по времени запуска, затем фолбэк "без времени")
+    with _tracer.span("discover", task_id=_id, client=client_name) as m:
+        out_files = read_manifest(manifest)
+        safe_remove(Path(manifest))
+        m["via"] = "manifest" if out_files is not None else "index"
+        if out_files is None:
+            out_files = (_output_index.files_for_id(_id, run_start_ts)
+                         or _output_index.files_for_id(_id, None))
+        m["rows"] = len(out_files)
+
+    finish_task(status_writer, leases, r, cache_key, out_files=out_files)
+    return True
+
+def process_batch(status_writer: StatusWriter, leases: LeaseKeeper, rows: list, run_start_ts: float) -> bool:
+    """
+    Строки одного скрипта (и спецификации) — один запуск по пакетному контракту: TASK_IDS, TASK_PAYLOADS.
+    Скрипт дописывает итог по каждому id в манифест по мере обработки (строки — по порядку TASK_PAYLOADS).
+    При таймауте, ошибке запуска или ненулевом коде строки с записанным итогом завершаются по нему; первая
+    строка без итога (на ней запуск и оборвался) получает общую причину (TIMEOUT, RETURN_CODE_X, ...) и попытку,
+    но не кэшируется; остальные не начинались — BATCH_ABORTED, в очередь снова без попытки и без кэша.
+    Кэшируются только ошибки, которые манифест приписал своему id.
+    Возвращает True, если клиентский скрипт запускался.
+    """
+    todo = []
+    for r in rows:
+        prepared = prepare_task(status_writer, leases, r)
+        if prepared is not None:
+            todo.append((r, *prepared))
+    if not todo:
+        return False
+    if len(todo) == 1:  # остальные закрыты кэшем — обычный запуск, без пакета
+        return process_task(status_writer, leases, todo[0][0], run_start_ts, todo[0][1:])
+
+    r0, spec_path, _ = todo[0]
+    script, client_name = r0[11], r0[6]
+    ids = [t[0][0] for t in todo]
+    label = f"id={ids[0]}..{ids[-1]} ({len(ids)})"
+    for n, (r, _, _) in enumerate(todo, 1):
+        status_writer.set(r[0], STAT_PROC, None, durable=n == len(todo), release=False)  # одна транзакция
+    log(f" - {label} запускаю пакетом: {script}")
+
+    manifest = batch_manifest_path(ids)
+    safe_remove(Path(manifest))
+    trace_file = task_trace_path(ids[0])  # span'ы скрипта несут свой task_id
+    if trace_file:
+        safe_remove(Path(trace_file))
+    task_env = {
+        "TASK_IDS": ",".join(map(str, ids)),
+        "TASK_PAYLOADS": json.dumps([dict(zip(COLUMNS, t[0])) for t in todo], ensure_ascii=False, default=str),
+        "TASK_CLIENT": str(client_name or ""),
+        "TASK_MANIFEST": manifest,
+        "TASK_TRACE": trace_file or "",
+        "TASK_SPEC": spec_path or "",
+        "TASK_OUTPUT_FORMAT": task_output_format(),
+    }
+
+    timeout = min(SCRIPT_TIMEOUT_SEC * len(ids), BATCH_TIMEOUT_SEC)
+    common = None  # причина для строк, по которым скрипт не успел сообщить итог
+    try:
+        with _tracer.span("script", task_id=ids[0], client=client_name, mode=EXEC_MODE, batch=len(ids)):
+            returncode, stdout, stderr = execute_script(script, task_env, task_log_path(ids[0]), timeout)
+    except subprocess.TimeoutExpired:
+        log(f"   {label} TIMEOUT ({script}) > {timeout}s")
+        common = "TIMEOUT"
+    except Exception as e:
+        log(f"   {label} ERROR запуск {script}: {e}")
+        common = f"LAUNCH_ERROR:{e}"
+    finally:
+        collect_task_trace(trace_file)
+    if common is None:
+        log_output_tails(label, stdout, stderr)
+        if returncode != 0:
+            log(f"   {label} FAIL code={returncode}")
+            common = f"RETURN_CODE_{returncode}"
+
+    with _tracer.span("discover", task_id=ids[0], client=client_name, batch=len(ids)) as m:
+        results = read_batch_manifest(manifest)
+        safe_remove(Path(manifest))
+        m["rows"] = len(results)
+    aborted_at = None  # строка, на которой оборвался пакет
+    requeued = 0
+    for r, _, cache_key in todo:
+        _id = r[0]
+        res = results.get(_id)
+        if res is None and common is not None:
+            if aborted_at is None:
+                aborted_at = _id
+                fail_task(status_writer, _id, r[10], common)  # попытка — да, кэш — нет: ошибку не приписать данным
             else:
-                out_csv = write_empty_marker()
-                print(f"[STEP] Задач нет. Обновлен пустой реестр: {out_csv}")
+                status_writer.set(_id, STAT_ERROR, "BATCH_ABORTED")  # не запускалась: попытку не тратим
+                requeued += 1
+        elif res is None:  # скрипт не сообщил об id — ищем, как без манифеста
+            out_files = (_output_index.files_for_id(_id, run_start_ts) or _output_index.files_for_id(_id, None))
+            finish_task(status_writer, leases, r, cache_key, out_files=out_files)
+        elif res.get("error"):
+            log(f"   id={_id} ошибка в пакете: {res['error']}")
+            finish_task(status_writer, leases, r, cache_key, reason="RETURN_CODE_1")  # как падение одиночного запуска
+        else:
+            finish_task(status_writer, leases, r, cache_key,
+                        out_files=[Path(p) for p in res.get("outputs", []) if os.path.isfile(p)])
+    if aborted_at is not None:
+        log(f"   {label} оборвался на id={aborted_at} ({common}); не начатых строк снова в очереди: {requeued}")
+    return True
+
+def retry_delay(reason: str, attempt: int) -> float:
+    """Пауза до следующей попытки, сек: временные помехи — коротко, остальное — экспоненциально."""
+    if reason in ("TIMEOUT", "LOCKED"):
+        return RETRY_FAST_SEC
+    return min(RETRY_MAX_SEC, RETRY_BASE_SEC * 2 ** max(0, attempt - 1))
+
+def fail_task(status_writer: StatusWriter, _id: int, attempt_count: int | None, reason: str) -> None:
+    """ERROR с расписанием следующей попытки; после RETRY_MAX_ATTEMPTS — терминальный FAILED."""
+    attempts = (attempt_count or 0) + 1
+    if attempts >= RETRY_MAX_ATTEMPTS:
+        log(f"   id={_id} попытка {attempts} из {RETRY_MAX_ATTEMPTS} -> {STAT_FAILED} ({reason})")
+        status_writer.set(_id, STAT_FAILED, reason, attempts=attempts)
+        return
+    next_at = datetime.now().astimezone() + timedelta(seconds=retry_delay(reason, attempts))
+    status_writer.set(_id, STAT_ERROR, reason, attempts=attempts, next_attempt_at=next_at)
+
+def deliver_outputs(status_writer: StatusWriter, leases: LeaseKeeper, _id: int, attempt_count: int | None,
+                    out_files: list[Path]) -> None:
+    """
+    Отдаем результаты id фоновому переносчику в LOAD_DIR; когда все файлы обработаны — CREATED
+    (или ERROR с причиной последней неудачи). С heartbeat строку снимает запись статуса (on_release).
+    """
+    files = [Path(p) for p in out_files]
+    nbytes = 0
+    for p in files:
+        try:
+            nbytes += p.stat().st_size
+        except OSError:
+            pass
+    if _loader is not None:
+        if files and all(p.suffix.lower() == ".csv" for p in files):
+            load_outputs(status_writer, leases, _id, attempt_count, files, nbytes)
+            return
+        log(f"   id={_id} результаты не CSV -> перенос в LOAD_DIR вместо загрузки")
+    t0 = time.perf_counter()
+
+    def on_done(moved: int, last_reason: str) -> None:
+        _tracer.emit("move", time.perf_counter() - t0, rows=moved, nbytes=nbytes, task_id=_id)
+        if moved > 0:
+            log(f"   OK: id={_id} перенесено файлов={moved}, статус -> CREATED")
+            status_writer.set(_id, STAT_CREATED, None)
+        else:
+            log(f"   ERROR: id={_id} ни один файл не перенесен (последняя причина: {last_reason})")
+            fail_task(status_writer, _id, attempt_count, last_reason)
+
+    _mover.submit(_id, files, on_done)
+
+def load_outputs(status_writer: StatusWriter, leases: LeaseKeeper, _id: int, attempt_count: int | None,
+                 files: list[Path], nbytes: int) -> None:
+    """
+    COPY результатов id в STAGING_TABLE одной транзакцией с CREATED; загруженные файлы удаляем.
+    При ошибке откатывается все (строки и статус) — ERROR с попыткой позже.
+    """
+    try:
+        with _tracer.span("load", task_id=_id, nbytes=nbytes) as m:
+            rows = _loader.load(_id, files, lambda cur: status_writer.set_in_transaction(cur, _id, STAT_CREATED))
+            m["rows"] = rows
+    except (psycopg2.Error, LoadError, OSError) as e:
+        detail = (str(e).strip().splitlines() or [type(e).__name__])[0]
+        log(f"   ERROR: id={_id} загрузка в {STAGING_TABLE} не удалась: {detail}")
+        fail_task(status_writer, _id, attempt_count, f"LOAD_ERROR:{detail}")
+        return
+    leases.done(_id)  # CREATED уже зафиксирован вместе с данными
+    log(f"   OK: id={_id} загружено строк={rows} (файлов={len(files)}) в {STAGING_TABLE}, статус -> CREATED")
+    for p in files:
+        safe_remove(p)
+
+def _timed_task(status_writer: StatusWriter, leases: LeaseKeeper, rows: list,
+                run_start_ts: float) -> tuple[bool, float]:
+    """Строка (или пакет строк одного скрипта) в потоке пула -> (запускался ли скрипт, время, сек)."""
+    t0 = time.perf_counter()
+    try:
+        if len(rows) == 1:
+            with _tracer.span("task", task_id=rows[0][0], client=rows[0][6]):
+                launched = process_task(status_writer, leases, rows[0], run_start_ts)
+        else:
+            with _tracer.span("task", task_id=rows[0][0], client=rows[0][6], batch=len(rows)):
+                launched = process_batch(status_writer, leases, rows, run_start_ts)
+    except BaseException:
+        # строки без финального статуса: heartbeat больше не продлеваем — аренда истечет, строку возьмут снова
+        # (завершенные строки пакета снимет запись их статуса, строки с переносом в работе — колбэк переносчика)
+        pending = status_writer.pending()
+        for r in rows:
+            if r[0] not in pending and not _mover.owns(r[0]):
+                leases.done(r[0])
+        raise
+    return launched, time.perf_counter() - t0
+
+def run_tasks(status_writer: StatusWriter, leases: LeaseKeeper, batches, run_start_ts: float,
+              max_workers: int = MAX_WORKERS, batch_size: int = BATCH_MAX_TASKS, *,
+              poll_new=None) -> tuple[int, int, float]:
+    """
+    Запуск задач пулом из max_workers потоков (сами скрипты — отдельные процессы).
+    batches — итератор пачек строк; следующую пачку берем, когда в очереди меньше 2 × max_workers строк
+    (как CLAIM_BATCH), чтобы не держать аренды строк, до которых далеко: остальное разбирают другие узлы.
+    Только если во главе очереди строка пакетного скрипта, очередь добираем до max_workers × (batch_size + 1) —
+    на полные пакеты. Соблюдаем лимиты
+    CLIENT_MAX_PARALLEL; среди доступных клиентов берем самую раннюю строку (порядок uploaded_at сохраняется).
+    Если скрипт понимает пакетный контракт, за ней из очереди клиента подряд берутся строки того же скрипта
+    и провайдера — в один запуск (пакет занимает одно место в пуле и в лимите клиента). Размер пакета —
+    очередь клиента, поделенная на свободные места (потоки пула и остаток лимита клиента), но не больше
+    batch_size: короткая очередь расходится по свободным потокам, а не уходит одним пакетом в один.
+    poll_new() (демон, см. notified_rows) опрашивается раз в DAEMON_POLL_SEC: новые строки встают в очередь
+    и занимают свободные потоки, пока идут длинные задачи. Если проход прерван ошибкой, аренды строк,
+    не ушедших в работу, отпускаются.
+    Возвращает (число задач, число запусков, суммарное время задач, сек).
+    """
+    max_workers = max(1, max_workers)
+    batch_size = max(1, batch_size)
+    queues: dict[str, deque] = {}
+    seq = itertools.count()
+    pending = 0
+    total = 0
+    exhausted = False
+
+    in_flight: Counter = Counter()
+    running: dict = {}
+    launched = 0
+    busy = 0.0
+
+    def enqueue(batch) -> None:
+        nonlocal pending, total
+        for r in batch:
+            queues.setdefault(str(r[6]), deque()).append((next(seq), r))
+        pending += len(batch)
+        total += len(batch)
+
+    def batchable(r) -> bool:
+        return batch_size > 1 and r[11] != "NO_SCRIPT_FOUND" and _scripts.supports_batch(r[11])
+
+    def lookahead() -> int:
+        heads = [q[0] for q in queues.values() if q]
+        if heads and batchable(min(heads)[1]):
+            return max_workers * (batch_size + 1)
+        return 2 * max_workers
+
+    def refill() -> None:
+        nonlocal exhausted
+        while not exhausted and pending < lookahead():
+            batch = next(batches, None)
+            if batch is None:
+                exhausted = True
                 return
+            enqueue(batch)
 
-            print("\n[STEP] Запуск клиентских скриптов по реестру...")
-            any_launched = False
+    def next_rows():
+        best = None
+        for client, q in queues.items():
+            if not q:
+                continue
+            limit = CLIENT_MAX_PARALLEL.get(client)
+            if limit and in_flight[client] >= limit:
+                continue
+            if best is None or q[0][0] < queues[best][0][0]:
+                best = client
+        if best is None:
+            return None, []
+        q = queues[best]
+        slots = max_workers - len(running)
+        limit = CLIENT_MAX_PARALLEL.get(best)
+        if limit:
+            slots = min(slots, limit - in_flight[best])
+        size = min(batch_size, math.ceil(len(q) / max(1, slots)))
+        rows = [q.popleft()[1]]
+        first = rows[0]
+        if size > 1 and batchable(first):
+            while q and len(rows) < size and (q[0][1][11], q[0][1][3]) == (first[11], first[3]):
+                rows.append(q.popleft()[1])
+        return best, rows
 
-            for r in rows:
-                (_id, file_path, status, data_provider, report_year, report_month,
-                 client_name, report_type, uploaded_at, created_at, script) = r
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        try:
+            while True:
+                refill()
+                if poll_new is not None:
+                    enqueue(poll_new())
+                while len(running) < max_workers:
+                    client, rows = next_rows()
+                    if not rows:
+                        break
+                    pending -= len(rows)
+                    in_flight[client] += 1
+                    running[pool.submit(_timed_task, status_writer, leases, rows, run_start_ts)] = client
+                if not running:
+                    break
+                done, _ = wait(running, timeout=DAEMON_POLL_SEC if poll_new is not None else None,
+                               return_when=FIRST_COMPLETED)
+                for fut in done:
+                    in_flight[running.pop(fut)] -= 1
+                    was_launched, elapsed = fut.result()
+                    launched += int(was_launched)
+                    busy += elapsed
+        except BaseException:
+            leases.release([r[0] for q in queues.values() for _, r in q])
+            raise
+    return total, launched, busy
 
-                if not script or script == "NO_SCRIPT_FOUND" or not os.path.isfile(script):
-                    print(f" - id={_id} скрипт не найден -> PROCESSING(reason=NO_SCRIPT_FOUND)")
-                    db_update_status(conn, _id, STAT_PROC, "NO_SCRIPT_FOUND")
-                    continue
+def scripts_signature() -> str:
+    """Отпечаток каталога скриптов: файлы в папках клиентов (имя, размер, mtime)."""
+    h = hashlib.sha256()
+    try:
+        providers = sorted(os.scandir(SCRIPTS_BASE), key=lambda e: e.name)
+    except OSError:
+        return ""
+    for provider in providers:
+        if not provider.is_dir():
+            continue
+        for client in sorted(os.scandir(provider.path), key=lambda e: e.name):
+            if not client.is_dir():
+                continue
+            for f in sorted(os.scandir(client.path), key=lambda e: e.name):
+                if f.is_file():
+                    st = f.stat()
+                    h.update(f"{provider.name}/{client.name}/{f.name}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
 
-                # ставим PROCESSING и запускаем
-                db_update_status(conn, _id, STAT_PROC, None)
-                any_launched = True
-                print(f" - id={_id} запускаю: {script}")
+def requeue_no_script_rows(conn) -> None:
+    """Каталог скриптов изменился — строки NO_SCRIPT_FOUND снова в очередь (next_attempt_at = NULL)."""
+    sig = scripts_signature()
+    try:
+        with open(SCRIPTS_SIGNATURE_PATH, encoding="utf-8") as f:
+            if f.read().strip() == sig:
+                return
+    except OSError:
+        pass
+    with _db_lock:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE ops.file_registry SET next_attempt_at = NULL
+                WHERE error_reason = 'NO_SCRIPT_FOUND' AND next_attempt_at IS NOT NULL;
+            """)
+            requeued = cur.rowcount
+        conn.commit()
+    with open(SCRIPTS_SIGNATURE_PATH, "w", encoding="utf-8") as f:
+        f.write(sig)
+    log(f"[STEP] Каталог скриптов изменился: NO_SCRIPT_FOUND снова в очереди ({requeued} строк)")
 
-                # Передаем TASK_ID и метаданные в окружение
-                env = os.environ.copy()
-                env.update({
-                    "TASK_ID": str(_id),
-                    "TASK_CLIENT": str(client_name or ""),
-                    "TASK_FILE": str(file_path or ""),
-                    "TASK_REPORT_TYPE": str(report_type or "")
-                })
+def run_cycle(status_writer: StatusWriter, leases: LeaseKeeper, only: list[int] | None = None,
+              listen_conn=None) -> int:
+    """
+    Один проход по очереди: захват строк, выполнение, снимок реестра. only — только эти id
+    (строки из уведомлений); listen_conn (демон) — уведомления во время прохода берутся сразу (notified_rows).
+    Возвращает число взятых задач.
+    """
+    run_start_ts = time.time()
+    _tracer.path = trace_path()
+    _scripts.clear()  # скрипты могли появиться или измениться между проходами
+    requeue_no_script_rows(status_writer.conn)
+    snapshot = RegistrySnapshot()
+    batches = claimed_batches(leases, snapshot, only=only)
+    first = next(batches, None)
+    if first is None:
+        out_csv = snapshot.close()
+        print(f"[STEP] Задач нет. Обновлен пустой реестр: {out_csv}")
+        return 0
 
-                try:
-                    proc = subprocess.run(
-                        [PYTHON_EXE, script],
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        text=True,
-                        timeout=SCRIPT_TIMEOUT_SEC,
-                        env=env,
-                    )
-                except subprocess.TimeoutExpired:
-                    print(f"   TIMEOUT ({script}) > {SCRIPT_TIMEOUT_SEC}s")
-                    db_update_status(conn, _id, STAT_ERROR, "TIMEOUT")
-                    continue
-                except Exception as e:
-                    print(f"   ERROR запуск {script}: {e}")
-                    db_update_status(conn, _id, STAT_ERROR, f"LAUNCH_ERROR:{e}")
-                    continue
+    print(f"\n[STEP] Запуск клиентских скриптов по реестру (node={NODE_ID}, "
+          f"workers={MAX_WORKERS}, mode={EXEC_MODE})...")
+    wall_t0 = time.perf_counter()
+    try:
+        poll_new = notified_rows(listen_conn, leases, snapshot) if listen_conn is not None else None
+        total, launched, busy = run_tasks(status_writer, leases, itertools.chain([first], batches), run_start_ts,
+                                          poll_new=poll_new)
+    finally:
+        _mover.drain()  # переносы последних задач
+        status_writer.flush()
+        if _metrics is not None:
+            _metrics.flush()
+        out_csv = snapshot.close()
+    wall = time.perf_counter() - wall_t0
+    print(f"[STEP] Реестр сформирован: {out_csv} | записей: {snapshot.count}")
 
-                # печатаем хвосты логов даже при returncode==0 (если есть)
-                if proc.stdout:
-                    print("   STDOUT(last 1000):\n", proc.stdout[-1000:])
-                if proc.stderr:
-                    print("   STDERR(last 1000):\n", proc.stderr[-1000:])
+    if not launched:
+        print("   Нет скриптов для запуска (все NO_SCRIPT_FOUND).")
+    speedup = busy / wall if wall > 0 else 1.0
+    print(f"[STEP] Задач: {total}, запущено скриптов: {launched} | "
+          f"wall={wall:.1f}s, сумма по задачам={busy:.1f}s, ускорение x{speedup:.2f}")
+    return total
 
-                if proc.returncode != 0:
-                    print(f"   FAIL code={proc.returncode}")
-                    db_update_status(conn, _id, STAT_ERROR, f"RETURN_CODE_{proc.returncode}")
-                    continue
+def evict_result_cache() -> None:
+    if _result_cache is None:
+        return
+    removed, size_mb = _result_cache.evict()
+    log(f"[STEP] Кэш результатов: удалено записей {removed}, объем {size_mb:.0f} МБ")
 
-                # ищем и переносим файлы для id — сперва по времени запуска, затем фолбэк "без времени"
-                out_files = files_for_id(FINAL_DIR, _id, run_start_ts)
-                if not out_files:
-                    out_files = files_for_id(FINAL_DIR, _id, None)
+def trace_path() -> str | None:
+    return os.path.join(TRACE_DIR, f"trace_{NODE_ID.replace(':', '_')}_{datetime.now():%Y%m%d}.jsonl") if TRACE_DIR else None
 
-                if not out_files:
-                    print(f"   WARN: нет файлов для id={_id} в '{FINAL_DIR}'")
-                    db_update_status(conn, _id, STAT_ERROR, "NO_OUTPUT_FILE")
-                    continue
+def _start_session(conn, connect_sec: float) -> tuple[StatusWriter, LeaseKeeper]:
+    """Общая подготовка запуска: каталоги, служебная схема, аренды, пул воркеров, переносчик, трассировка."""
+    global _warm_pool, _mover, _loader, _tracer, _metrics
+    for d in (REESTR_DIR, FINAL_DIR, LOAD_DIR, MANIFEST_DIR):
+        ensure_dir(d)
+    db_ensure_schema(conn)
+    _metrics = MetricsWriter(conn) if TRACE_TO_DB else None
+    _tracer = Tracer(trace_path(), on_span=_metrics.add if _metrics else None, log=log,
+                     source="orchestrator", node=NODE_ID)
+    _tracer.emit("connect", connect_sec)
+    leases = LeaseKeeper(conn)
+    leases.start()
+    if EXEC_MODE == "warm":
+        _warm_pool = WarmWorkerPool(WORKER_MAX_TASKS, WORKER_MAX_RSS_MB, WORKER_PRELOAD, OUTPUT_TAIL_CHARS,
+                                    code_dirs=(COMMON_DIR,))
+    _mover = BackgroundMover(LOAD_DIR, MOVE_MAX_RETRIES, MOVE_RETRY_SLEEP, MOVE_RETRY_MAX_SLEEP, MOVE_WORKERS, log=log)
+    if LOAD_MODE == "copy":
+        if OUTPUT_FORMAT != "csv":
+            print(f"[WARN] LOAD_MODE='copy' грузит CSV: OUTPUT_FORMAT='{OUTPUT_FORMAT}' не используется")
+        _loader = BulkLoader(db_connect, STAGING_TABLE, load_schema(HEADER_PATH).columns, log=log)
+        _loader.ensure_table()
+        print(f"[STEP] Загрузка результатов: COPY в {STAGING_TABLE}")
+    status_writer = StatusWriter(conn, on_release=leases.done)  # heartbeat — пока финальный статус не в БД
+    status_writer.start()
+    return status_writer, leases
 
-                moved = 0
-                last_reason = "OK"
-                for src in out_files:
-                    ok, reason, dst = move_with_retries(Path(src), Path(LOAD_DIR))
-                    last_reason = reason
-                    if ok:
-                        moved += 1
-                    else:
-                        print(f"   WARN: не смог перенести '{src.name}' -> {reason}")
-
-                if moved > 0:
-                    print(f"   OK: перенесено файлов={moved}, статус -> CREATED")
-                    db_update_status(conn, _id, STAT_CREATED, None)
-                else:
-                    print(f"   ERROR: ни один файл не перенесен (последняя причина: {last_reason})")
-                    db_update_status(conn, _id, STAT_ERROR, last_reason)
-
-            if not any_launched:
-                print("   Нет скриптов для запуска (все NO_SCRIPT_FOUND).")
+def _end_session(status_writer: StatusWriter, leases: LeaseKeeper) -> None:
+    global _warm_pool, _mover, _loader
+    try:
+        if _mover is not None:
+            _mover.close()
+            _mover = None
+        status_writer.stop()
+        status_writer.flush()
+        if _metrics is not None:
+            _metrics.flush()
+    finally:
+        if _loader is not None:
+            _loader.close()
+            _loader = None
+        if _warm_pool is not None:
+            _warm_pool.close()
+            _warm_pool = None
+        leases.stop()
+        print("[STEP] Аренды сняты. Завершено.")
 
+def run_pipeline():
+    """Разовый запуск (по расписанию): один полный проход очереди."""
+    t0 = time.perf_counter()
+    with db_connect() as conn:
+        status_writer, leases = _start_session(conn, time.perf_counter() - t0)
+        try:
+            housekeeping = start_housekeeping(time.time())
+            run_cycle(status_writer, leases)
+            housekeeping.join()
         finally:
-            db_advisory_unlock(conn)
-            print("[STEP] Advisory lock снят. Завершено.")
+            _end_session(status_writer, leases)
+
+def _drain_notifications(listen_conn) -> list[int]:
+    """id из уже пришедших уведомлений (без ожидания)."""
+    listen_conn.poll()
+    ids = []
+    for note in listen_conn.notifies:
+        if note.payload.isdigit():
+            ids.append(int(note.payload))
+    listen_conn.notifies.clear()
+    return ids
+
+def _wait_notifications(listen_conn, timeout: float) -> list[int] | None:
+    """Ждем NOTIFY до timeout сек. Возвращает id из уведомлений или None, если их не было."""
+    if select.select([listen_conn], [], [], max(0.0, timeout)) == ([], [], []):
+        return None
+    time.sleep(DAEMON_DEBOUNCE_SEC)
+    return _drain_notifications(listen_conn)
+
+def _daemon_cycle(status_writer: StatusWriter, leases: LeaseKeeper, listen_conn,
+                  only: list[int] | None = None) -> bool:
+    """
+    Проход демона: ошибка прохода (кроме потери соединения с БД) не останавливает демона — пишем ее,
+    ждем DAEMON_ERROR_BACKOFF_SEC и возвращаем False.
+    """
+    try:
+        run_cycle(status_writer, leases, only=only, listen_conn=listen_conn)
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        raise
+    except Exception as e:
+        log(f"[WARN] Проход завершился ошибкой: {type(e).__name__}: {e}\n{traceback.format_exc()}"
+            f"Следующий проход через {DAEMON_ERROR_BACKOFF_SEC}s")
+        time.sleep(DAEMON_ERROR_BACKOFF_SEC)
+        return False
+
+def _daemon_session() -> None:
+    t0 = time.perf_counter()
+    # соединение LISTEN — не через with: в psycopg2 2.9 блок with открывает транзакцию даже в autocommit,
+    # LISTEN в ней не фиксируется и уведомления не приходят
+    listen_conn = db_connect()
+    try:
+        listen_conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with listen_conn.cursor() as cur:
+            cur.execute(f"LISTEN {NOTIFY_CHANNEL};")
+        with db_connect() as conn:
+            status_writer, leases = _start_session(conn, time.perf_counter() - t0)
+            try:
+                last_sweep = None
+                housekeeping = None
+                while True:
+                    if last_sweep is None or time.monotonic() - last_sweep >= DAEMON_SWEEP_SEC:
+                        print(f"[STEP] Периодический проход (очистка '{FINAL_DIR}', вся очередь)...")
+                        if housekeeping is None or not housekeeping.is_alive():
+                            housekeeping = start_housekeeping(time.time())
+                        last_sweep = time.monotonic()
+                        if not _daemon_cycle(status_writer, leases, listen_conn):
+                            last_sweep = None  # проход не удался — повторяем полный проход после паузы
+                            continue
+                    ids = _wait_notifications(listen_conn, DAEMON_SWEEP_SEC - (time.monotonic() - last_sweep))
+                    if ids:
+                        print(f"[STEP] Уведомление: новых строк {len(ids)}")
+                        if not _daemon_cycle(status_writer, leases, listen_conn, only=ids):
+                            last_sweep = None  # строки из уведомления подберет полный проход
+            finally:
+                _end_session(status_writer, leases)
+    finally:
+        listen_conn.close()
+
+def run_daemon():
+    """
+    Долгоживущий режим: LISTEN на NOTIFY_CHANNEL — новые строки берем в работу за секунды,
+    раз в DAEMON_SWEEP_SEC — полный проход очереди. Подготовка (подключение, схема, воркеры)
+    выполняется один раз; при потере соединения с БД переподключаемся, при прочих ошибках — пишем их,
+    ждем и продолжаем.
+    """
+    print(f"[STEP] Режим демона: канал '{NOTIFY_CHANNEL}', полный проход раз в {DAEMON_SWEEP_SEC}s")
+    while True:
+        try:
+            _daemon_session()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            print(f"[WARN] Потеряно соединение с БД: {e}. Переподключение через {DAEMON_RECONNECT_SEC}s")
+            time.sleep(DAEMON_RECONNECT_SEC)
+        except KeyboardInterrupt:
+            print("[STEP] Остановка демона.")
+            return
+        except Exception as e:
+            log(f"[WARN] Сессия демона завершилась ошибкой: {type(e).__name__}: {e}\n{traceback.format_exc()}"
+                f"Перезапуск через {DAEMON_RECONNECT_SEC}s")
+            time.sleep(DAEMON_RECONNECT_SEC)
 
 # ========== ENTRYPOINT ==========
 
 if __name__ == "__main__":
-    run_pipeline()
+    parser = argparse.ArgumentParser(description="Оркестратор обработки входных файлов")
+    parser.add_argument("--daemon", action="store_true",
+                        help="долгоживущий режим: LISTEN/NOTIFY + периодический проход очереди")
+    args = parser.parse_args()
+    if args.daemon:
+        run_daemon()
+    else:
+        run_pipeline()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Захват вывода клиентских скриптов с ограниченной памятью.
+
+TailBuffer хранит только последние N символов потока. TaskOutput раскладывает вывод задачи
+в хвосты stdout/stderr и (опционально) сразу пишет полный лог на диск построчно — лог виден,
+пока задача еще выполняется. run_streaming — замена subprocess.run(..., stdout=PIPE, stderr=PIPE):
+каналы читаются кусками и декодируются инкрементально, а не копятся целиком.
+"""
+
+import io
+import os
+import codecs
+import threading
+import subprocess
+from collections import deque
+
+READ_CHUNK = 8192
+
+
+class TailBuffer:
+    """Последние max_chars символов потока; память не растет с объемом вывода."""
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self._parts: deque[str] = deque()
+        self._size = 0
+
+    def write(self, text: str) -> None:
+        if not text:
+            return
+        if len(text) > self.max_chars:
+            text = text[-self.max_chars:]
+        self._parts.append(text)
+        self._size += len(text)
+        while self._parts and self._size - len(self._parts[0]) >= self.max_chars:
+            self._size -= len(self._parts.popleft())
+
+    def getvalue(self) -> str:
+        return "".join(self._parts)[-self.max_chars:]
+
+
+class _Stream(io.TextIOBase):
+    """Файлоподобный канал (stdout/stderr) поверх TaskOutput — годится для redirect_stdout."""
+
+    def __init__(self, owner: "TaskOutput", tail: TailBuffer):
+        self._owner = owner
+        self._tail = tail
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        self._owner._write(self._tail, text)
+        return len(text)
+
+
+class TaskOutput:
+    """Хвосты stdout/stderr задачи + общий (stdout и stderr вперемешку) лог-файл на диске."""
+
+    def __init__(self, tail_chars: int, log_path: str | None = None):
+        self._out_tail = TailBuffer(tail_chars)
+        self._err_tail = TailBuffer(tail_chars)
+        self.stdout = _Stream(self, self._out_tail)
+        self.stderr = _Stream(self, self._err_tail)
+        self._lock = threading.Lock()
+        self._log = None
+        if log_path:
+            os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+            self._log = open(log_path, "a", encoding="utf-8", errors="replace", buffering=1)
+
+    def _write(self, tail: TailBuffer, text: str) -> None:
+        with self._lock:
+            tail.write(text)
+            if self._log is not None:
+                self._log.write(text)
+
+    def tails(self) -> tuple[str, str]:
+        with self._lock:
+            return self._out_tail.getvalue(), self._err_tail.getvalue()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+
+def _pump(pipe, stream: _Stream) -> None:
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    with pipe:
+        while True:
+            chunk = pipe.read1(READ_CHUNK)
+            if not chunk:
+                break
+            stream.write(decoder.decode(chunk))
+    stream.write(decoder.decode(b"", final=True))
+
+
+def run_streaming(cmd: list[str], env: dict, timeout: float, tail_chars: int,
+                  log_path: str | None = None) -> tuple[int, str, str]:
+    """
+    Запуск процесса с потоковым чтением вывода -> (returncode, хвост stdout, хвост stderr).
+    При таймауте процесс убивается и поднимается subprocess.TimeoutExpired.
+    """
+    env = dict(env, PYTHONUNBUFFERED="1", PYTHONIOENCODING="utf-8")  # строки приходят сразу и в utf-8
+    output = TaskOutput(tail_chars, log_path)
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        readers = [
+            threading.Thread(target=_pump, args=(proc.stdout, output.stdout), daemon=True),
+            threading.Thread(target=_pump, args=(proc.stderr, output.stderr), daemon=True),
+        ]
+        for t in readers:
+            t.start()
+        try:
+            returncode = proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            for t in readers:
+                t.join(5)
+        return (returncode,) + output.tails()
+    finally:
+        output.close()
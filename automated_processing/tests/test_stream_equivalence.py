@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Потоковое чтение CSV (части по CSV_CHUNK_ROWS) дает тот же файл результата, что и чтение целиком — байт в байт,
+в том числе когда пропуск в целом столбце встречается только в поздней части.
+
+Запуск: python -m pytest automated_processing/tests
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parents[1]  # automated_processing
+sys.path.insert(0, str(ROOT_DIR))
+sys.path.insert(0, str(ROOT_DIR / "benchmarks"))
+
+from common import engine  # noqa: E402
+from common.trace import Tracer  # noqa: E402
+from synthetic import make_frame  # noqa: E402
+
+SCRIPTS_DIR = ROOT_DIR / "Scripts" / "Distibutors"
+HEADER_PATH = ROOT_DIR / "report_header" / "report_header.xlsx"
+ROWS = 3000
+CHUNK_ROWS = 500
+NAN_ROW = 1500  # пропуск — в четвертой части, первая часть целиком из целых
+
+
+def _source(client: str, tmp_path: Path, with_nan: bool) -> Path:
+    df = make_frame(client, ROWS, seed=1)
+    if with_nan:
+        for c in df.columns:
+            if pd.api.types.is_integer_dtype(df[c]):
+                df[c] = df[c].astype("Int64")
+                df.loc[NAN_ROW, c] = pd.NA
+    path = tmp_path / f"{client}.csv"
+    df.to_csv(path, sep=";", index=False, encoding="utf-8-sig")
+    return path
+
+
+def _run(client: str, src: Path, out_dir: Path, stream: bool, monkeypatch) -> bytes:
+    out_dir.mkdir()
+    monkeypatch.setattr(engine, "OUTPUT_DIR", out_dir)
+    monkeypatch.setattr(engine, "PROFILE_DIR", out_dir / "profiles")
+    monkeypatch.setattr(engine, "HEADER_PATH", HEADER_PATH)
+    monkeypatch.setattr(engine, "CSV_STREAM_MIN_BYTES", 0 if stream else 1 << 62)
+    monkeypatch.setattr(engine, "CSV_CHUNK_ROWS", CHUNK_ROWS)
+    monkeypatch.delenv("TASK_OUTPUT_FORMAT", raising=False)
+    plan = engine.load_plan(SCRIPTS_DIR / client / f"{client}_spec.json")
+    row = {"id": 7, "file_path": str(src), "client_name": client, "report_type": "Type1",
+           "data_provider": "Дистрибьютор"}
+    out_path = engine.process_row(plan, row, Tracer(None))
+    assert out_path is not None
+    return out_path.read_bytes()
+
+
+@pytest.mark.parametrize("with_nan", [False, True])
+@pytest.mark.parametrize("client", ["Client_01", "Client_02", "Client_03"])
+def test_stream_matches_whole_file(client, with_nan, tmp_path, monkeypatch, capsys):
+    src = _source(client, tmp_path, with_nan)
+    whole = _run(client, src, tmp_path / "whole", False, monkeypatch)
+    streamed = _run(client, src, tmp_path / "stream", True, monkeypatch)
+    assert "Потоковое чтение не удалось" not in capsys.readouterr().out  # без отката на чтение целиком
+    assert streamed == whole
+
+
+def test_filter_keeps_nullable_missing_like_nan():
+    """Маска фильтра на nullable-столбце: пропуск ведет себя как NaN у float (!= — True, остальное — False)."""
+    spec = engine.ClientSpec("C", "T", {"qty": "amount_type_1"},
+                             filters=[{"column": "amount_type_1", "op": "!=", "value": 0}])
+    plan = engine.TransformPlan(spec)
+    schema = engine.TargetSchema(["amount_type_1"], {"amount_type_1": "float"}, {"amount_type_1": True})
+    nullable = plan.apply(pd.DataFrame({"qty": pd.array([1, 0, None], dtype="Int64")}), {}, schema)
+    floats = plan.apply(pd.DataFrame({"qty": np.array([1, 0, np.nan])}), {}, schema)
+    assert list(nullable.index) == list(floats.index) == [0, 2]
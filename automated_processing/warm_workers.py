@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Пул "тёплых" воркеров для клиентских скриптов.
+
+Воркер — долгоживущий процесс: один раз импортирует тяжелые библиотеки (pandas, openpyxl, chardet),
+загружает скрипт задачи через importlib (кэш по пути и mtime) — обычно common/spec_runner.py, который выполняет
+спецификацию клиента из TASK_SPEC, — и для каждой задачи вызывает его main() с переменными TASK_* в os.environ. Оркестратор получает (returncode, хвост stdout, хвост stderr) —
+так же, как от task_output.run_streaming; полный вывод задачи воркер пишет в ее лог-файл.
+
+Изоляция:
+- таймаут, падение процесса (segfault, os._exit) — воркер убивается, задача получает код возврата;
+- после WORKER_MAX_TASKS задач или при RSS > WORKER_MAX_RSS_MB воркер перезапускается;
+- скрипт задачи перезагружается по mtime, а общий код (code_dirs, например common\) — только вместе с воркером:
+  если его файлы изменились, воркеры, стартовавшие со старой версией, заменяются новыми;
+- скрипт без main() воркер не выполняет (returncode=None) — оркестратор запускает его как раньше.
+"""
+
+import os
+import sys
+import queue
+import threading
+import importlib
+import importlib.util
+import traceback
+import subprocess
+import multiprocessing as mp
+from contextlib import redirect_stdout, redirect_stderr
+
+from task_output import TaskOutput
+
+try:
+    import psutil
+except ImportError:  # не обязателен: без него RSS берем из resource (Linux) или не проверяем
+    psutil = None
+
+
+def _rss_mb() -> float | None:
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2**20
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # пиковый RSS, КБ -> МБ
+    except Exception:
+        return None
+
+
+def code_signature(dirs: tuple[str, ...]) -> tuple:
+    """Отпечаток общего кода: (путь, размер, mtime) файлов *.py в каталогах dirs."""
+    sig = []
+    for d in dirs:
+        try:
+            entries = sorted(os.scandir(d), key=lambda e: e.name)
+        except OSError:
+            continue
+        for e in entries:
+            if e.name.endswith(".py") and e.is_file():
+                st = e.stat()
+                sig.append((e.path, st.st_size, st.st_mtime_ns))
+    return tuple(sig)
+
+
+def _load_module(cache: dict, script: str):
+    """
+    Модуль скрипта из кэша; перезагружаем, если файл изменился.
+    Скрипт без "def main(" не импортируем (None): его логика на верхнем уровне выполнилась бы при загрузке.
+    """
+    mtime = os.path.getmtime(script)
+    cached = cache.get(script)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(script, encoding="utf-8", errors="replace") as f:
+        if "def main(" not in f.read():
+            cache[script] = (mtime, None)
+            return None
+    name = "_task_" + os.path.splitext(os.path.basename(script))[0]
+    spec = importlib.util.spec_from_file_location(name, script)
+    module = importlib.util.module_from_spec(spec)
+    script_dir = os.path.dirname(os.path.abspath(script))
+    if script_dir not in sys.path:
+        sys.path.insert(0, script_dir)  # как при запуске "python script.py"
+    spec.loader.exec_module(module)
+    cache[script] = (mtime, module)
+    return module
+
+
+def _worker_main(conn, preload: tuple[str, ...], tail_chars: int) -> None:
+    """Цикл воркера: (script, env, log_path) -> (returncode, хвост stdout, хвост stderr, rss_mb)."""
+    for name in preload:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass
+    modules: dict = {}
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if msg is None:
+            return
+        script, env, log_path = msg
+        try:
+            output = TaskOutput(tail_chars, log_path)
+        except OSError:
+            output = TaskOutput(tail_chars)
+        code = 0
+        saved_env = dict(os.environ)
+        os.environ.update(env)
+        try:
+            with redirect_stdout(output.stdout), redirect_stderr(output.stderr):
+                try:
+                    module = _load_module(modules, script)
+                    entry = getattr(module, "main", None) if module is not None else None
+                    if not callable(entry):
+                        code = None
+                    else:
+                        entry()
+                except SystemExit as e:
+                    if isinstance(e.code, int) or e.code is None:
+                        code = e.code or 0
+                    else:
+                        print(e.code, file=sys.stderr)
+                        code = 1
+                except BaseException:
+                    traceback.print_exc()
+                    code = 1
+        finally:
+            os.environ.clear()
+            os.environ.update(saved_env)
+            output.close()
+        conn.send((code, *output.tails(), _rss_mb()))
+
+
+class WarmWorker:
+    """Один процесс-воркер и канал к нему."""
+
+    def __init__(self, ctx, preload: tuple[str, ...], tail_chars: int, code_sig: tuple = ()):
+        self.code_sig = code_sig  # общий код на момент старта: его модули воркер не перезагружает
+        self.conn, child = ctx.Pipe()
+        self.proc = ctx.Process(target=_worker_main, args=(child, preload, tail_chars), daemon=True)
+        self.proc.start()
+        child.close()
+        self.tasks = 0
+        self.rss_mb: float | None = None
+
+    def run(self, script: str, env: dict, timeout: float, log_path: str | None) -> tuple[int | None, str, str]:
+        self.conn.send((script, env, log_path))
+        if not self.conn.poll(timeout):
+            self.kill()
+            raise subprocess.TimeoutExpired([script], timeout)
+        try:
+            code, out, err, self.rss_mb = self.conn.recv()
+        except (EOFError, OSError):
+            # процесс умер посреди задачи (segfault, os._exit, OOM killer): код всегда отрицательный,
+            # чтобы авария не выглядела как ошибка скрипта (RETURN_CODE_1 кэшируется как детерминированная)
+            self.proc.join(5)
+            exitcode = self.proc.exitcode
+            code = -abs(exitcode) if exitcode else -1
+            return code, "", f"[worker] процесс воркера завершился аварийно, exitcode={exitcode}"
+        self.tasks += 1
+        return code, out, err
+
+    def alive(self) -> bool:
+        return self.proc.is_alive()
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+        except Exception:
+            pass
+        self.proc.join(5)
+        if self.proc.is_alive():
+            self.kill()
+        self.conn.close()
+
+    def kill(self) -> None:
+        try:
+            self.proc.kill()
+            self.proc.join(5)
+        except Exception:
+            pass
+
+
+class WarmWorkerPool:
+    """
+    Пул воркеров. Размер пула ограничивает вызывающий (пул потоков оркестратора):
+    свободный воркер берется из очереди, иначе стартует новый. Воркер, стартовавший до изменения
+    общего кода (code_dirs), не переиспользуется: иначе он выполнял бы старый движок, а ключи кэша
+    результатов уже считались бы по новому.
+    """
+
+    def __init__(self, max_tasks: int, max_rss_mb: float, preload: tuple[str, ...], tail_chars: int,
+                 code_dirs: tuple[str, ...] = ()):
+        self.max_tasks = max_tasks
+        self.max_rss_mb = max_rss_mb
+        self.preload = preload
+        self.tail_chars = tail_chars
+        self.code_dirs = code_dirs
+        self._ctx = mp.get_context("spawn")  # как на Windows: воркер не наследует состояние оркестратора
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._all: set[WarmWorker] = set()
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> WarmWorker:
+        sig = code_signature(self.code_dirs)
+        while True:
+            try:
+                w = self._idle.get_nowait()
+            except queue.Empty:
+                w = WarmWorker(self._ctx, self.preload, self.tail_chars, sig)
+                with self._lock:
+                    self._all.add(w)
+                return w
+            if w.alive() and w.code_sig == sig:
+                return w
+            w.stop()  # умер или загрузил старый общий код
+            self._discard(w)
+
+    def _discard(self, w: WarmWorker) -> None:
+        with self._lock:
+            self._all.discard(w)
+
+    def _release(self, w: WarmWorker) -> None:
+        worn_out = w.tasks >= self.max_tasks or (w.rss_mb is not None and w.rss_mb > self.max_rss_mb)
+        if not w.alive() or worn_out:
+            w.stop()
+            self._discard(w)
+        else:
+            self._idle.put(w)
+
+    def run(self, script: str, env: dict, timeout: float,
+            log_path: str | None = None) -> tuple[int | None, str, str]:
+        """Выполнить main() скрипта в воркере. TimeoutExpired пробрасывается, воркер при этом убит."""
+        w = self._acquire()
+        try:
+            result = w.run(script, env, timeout, log_path)
+        except BaseException:
+            w.kill()
+            self._discard(w)
+            raise
+        self._release(w)
+        return result
+
+    def close(self) -> None:
+        with self._lock:
+            workers = list(self._all)
+            self._all.clear()
+        for w in workers:
+            w.stop()